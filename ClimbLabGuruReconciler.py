@@ -0,0 +1,217 @@
+#!/usr/env/bin python
+
+# Compare the samples in Climb against those in LabGuru, and report (and optionally
+# archive) LabGuru samples that no longer exist in Climb.
+
+from collections import defaultdict
+import configparser
+import datetime
+import logging
+import os
+import sys
+
+import ClimbSamples
+import LabGuruBioCollections
+
+
+class ClimbLabGuruReconciler:
+
+    """ Find the differences between the samples in Climb and those in LabGuru. """
+
+    def __init__(self, climb_samples, labguru_collections):
+
+        """
+
+        Read config file, initialize data members.
+
+        Parameters:
+
+            climb_samples (ClimbSamples): Used to get all samples from Climb.
+
+            labguru_collections (LabGuruBioCollections): Holds every sample already in LabGuru.
+
+        """
+
+        # Load config file, which is in the same directory as the source code.
+        config = configparser.ConfigParser()
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        config.read(os.path.join(src_dir, "config.cfg"))
+
+        self.report_dir = config["logging"]["log_dir"]
+        self.log_level = config["logging"]["level"]
+        self.archive_orphans = config.getboolean("reconcile", "archive_orphans", fallback=False)
+
+        self.climb_samples = climb_samples
+        self.labguru_collections = labguru_collections
+
+        # Results of the last call to reconcile. Each is keyed by short type.
+        self.climb_names = defaultdict(set)
+        self.failed_workgroups = []
+        self.labguru_counts = {}
+        self.orphans = {}
+        self.unmapped_types = defaultdict(int)
+
+
+    def reconcile(self, samples=None):
+
+        """
+
+        Find LabGuru samples missing from Climb, and Climb types that map to no collection.
+
+        Parameters:
+
+            samples (list): Optional list of Climb sample dicts, from every configured workgroup.
+                If not given, they are fetched.
+
+        Returns:
+
+            orphans (dict): Maps each short type to a sorted list of LabGuru sample names not in Climb.
+
+        """
+
+        self.failed_workgroups = []
+        if samples is None:
+            samples = self.climb_samples.get_samples()
+            # Samples in a workgroup we couldn't read would all look like orphans.
+            self.failed_workgroups = list(self.climb_samples.failed_workgroups)
+            if self.failed_workgroups:
+                logging.error(f"Could not read Climb workgroups {', '.join(self.failed_workgroups)}. "
+                    "Orphans will be reported but not archived.")
+
+        collection_types = set(self.labguru_collections.get_collection_short_types())
+
+        # Bucket the Climb names by collection in one pass. Types we skip on purpose are not unmapped.
+        self.climb_names = defaultdict(set)
+        self.unmapped_types = defaultdict(int)
+        for sample in samples:
+            sample_type = sample["type"]
+            if self.labguru_collections.is_skipped(sample_type):
+                continue
+            short_type = self.labguru_collections.get_short_type(sample_type)
+            if short_type in collection_types:
+                self.climb_names[short_type].add(sample["name"])
+            else:
+                self.unmapped_types[sample_type] += 1
+
+        # Merge the sorted Climb names against the LabGuru names, which are streamed in sorted order,
+        # so the LabGuru side is never held in memory.
+        self.labguru_counts = {}
+        self.orphans = {}
+        for short_type in sorted(collection_types):
+            climb_names = sorted(self.climb_names[short_type])
+            orphans = []
+            num_labguru = 0
+            i = 0
+            for name in self.labguru_collections.iter_sample_names(short_type):
+                num_labguru += 1
+                while i < len(climb_names) and climb_names[i] < name:
+                    i += 1
+                if i == len(climb_names) or climb_names[i] != name:
+                    orphans.append(name)
+            self.labguru_counts[short_type] = num_labguru
+            self.orphans[short_type] = orphans
+
+        num_orphans = sum(len(names) for names in self.orphans.values())
+        logging.info(f"Found {num_orphans} LabGuru samples missing from Climb, and "
+            f"{len(self.unmapped_types)} Climb sample types with no collection.")
+        return self.orphans
+
+
+    def archive(self):
+
+        """
+
+        Archive every orphan found by the last call to reconcile. Nothing is archived unless
+        every configured Climb workgroup was read.
+
+        Returns:
+
+            num_archived (int): The number of samples archived.
+
+        """
+
+        if self.failed_workgroups:
+            logging.error(f"Not archiving orphans, Climb workgroups {', '.join(self.failed_workgroups)} were not read.")
+            return 0
+
+        num_archived = 0
+        for short_type, names in self.orphans.items():
+            for name in names:
+                if self.labguru_collections.archive_sample(short_type, name):
+                    num_archived += 1
+        logging.info(f"Archived {num_archived} orphaned samples.")
+        return num_archived
+
+
+    def write_report(self):
+
+        """
+
+        Write a tab-delimited report of the last reconciliation to the log directory.
+
+        Returns:
+
+            report_path (str): The full path of the report.
+
+        """
+
+        report_file = "climb_to_labguru_reconcile_report_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".txt"
+        report_path = os.path.join(self.report_dir, report_file)
+        if not os.path.isdir(self.report_dir):
+            os.makedirs(self.report_dir, exist_ok=True)
+
+        with open(report_path, 'w') as f:
+            # Counts per collection first, then the types we couldn't map, then the orphan names.
+            f.write("collection\tclimb_count\tlabguru_count\tmissing_from_climb\n")
+            for short_type, names in self.orphans.items():
+                f.write(f"{short_type}\t{len(self.climb_names[short_type])}\t{self.labguru_counts[short_type]}\t{len(names)}\n")
+
+            f.write("\nunmapped_climb_type\tclimb_count\n")
+            for sample_type in sorted(self.unmapped_types):
+                f.write(f"{sample_type}\t{self.unmapped_types[sample_type]}\n")
+
+            f.write("\nunread_climb_workgroup\n")
+            for workgroup_name in self.failed_workgroups:
+                f.write(f"{workgroup_name}\n")
+
+            f.write("\ncollection\tmissing_from_climb\n")
+            for short_type, names in self.orphans.items():
+                for name in names:
+                    f.write(f"{short_type}\t{name}\n")
+
+        logging.info(f"Wrote reconciliation report to {report_path}")
+        return report_path
+
+
+    def setup_logger(self):
+
+        """ Log to a new file in the report directory, at the level set in the config file. """
+
+        if not os.path.isdir(self.report_dir):
+            os.makedirs(self.report_dir, exist_ok=True)
+        log_file = "climb_to_labguru_reconcile_log_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".txt"
+        log_path = os.path.join(self.report_dir, log_file)
+        print(f"Log file located at {log_path}")
+        logging.basicConfig(filename=log_path, filemode='w', level=logging.getLevelName(self.log_level),
+            format='%(asctime)s %(levelname)s: %(message)s')
+
+
+if __name__ == "__main__":
+
+    # Run by itself, this code reports the differences between Climb and LabGuru, and
+    # archives the orphans if the config file asks for it.
+
+    try:
+        # Reconciling only reports, so don't delete duplicates on the way in. The archive is the only change made.
+        reconciler = ClimbLabGuruReconciler(ClimbSamples.ClimbSamples(),
+            LabGuruBioCollections.LabGuruBioCollections(delete_duplicates=False))
+        reconciler.setup_logger()
+        reconciler.reconcile()
+        print(f"Report written to {reconciler.write_report()}")
+        if reconciler.archive_orphans:
+            reconciler.archive()
+
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        logging.error(f"{exc_type} in {fname}:{exc_tb.tb_lineno}")
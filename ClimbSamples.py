@@ -12,14 +12,25 @@ import utils
 
 class ClimbSamples:
 
-    def __init__(self):
+    def __init__(self, workgroup_names=None, config=None):
     
-        """ Read config file, initialize data members. """
+        """
+
+        Read config file, initialize data members.
+
+        Parameters:
+
+            workgroup_names (list): If given, only these workgroups are read instead of those in the config file.
+
+            config (ConfigParser): If given, used instead of the config file.
+
+        """
         
         # Load config file, which is in the same directory as the source code.
-        config = configparser.ConfigParser()
         src_dir = os.path.dirname(os.path.abspath(__file__))
-        config.read(os.path.join(src_dir, "config.cfg"))
+        if config is None:
+            config = configparser.ConfigParser()
+            config.read(os.path.join(src_dir, "config.cfg"))
         
         # Get the filename containing the password and read it. It is also in the
         # same directory as the code.
@@ -39,6 +50,15 @@ class ClimbSamples:
         
         # To get samples from more than one Climb instance, we use multiple workgroup_names
         self.workgroup_names = [x.strip() for x in config["climb"]["workgroup_names"].split(',')]
+        if workgroup_names:
+            self.workgroup_names = list(workgroup_names)
+
+        # The lookup of workgroup names to keys is cached between runs. It lives with the logs.
+        self.workgroup_cache_file = os.path.join(config["logging"]["log_dir"], config["climb"]["workgroup_cache_file"])
+        self.workgroup_cache_ttl = int(float(config["climb"]["workgroup_cache_ttl_hours"]) * 3600)
+
+        # The workgroups that couldn't be read by the last call to get_samples or iter_sample_pages.
+        self.failed_workgroups = []
         
         
     def get_samples(self):
@@ -56,33 +76,58 @@ class ClimbSamples:
         
         
         all_samples = []
+        for workgroup_name, curr_samples in self.iter_sample_pages():
+            all_samples += curr_samples
+        return all_samples
+
+
+    def iter_sample_pages(self, strict=False):
+
+        """
+
+        Get all samples from Climb one page at a time, without holding them all in memory.
+        Workgroups that can't be switched to are skipped, and listed in failed_workgroups.
+
+        Parameters:
+            strict (bool): Raise a RuntimeError instead of skipping a workgroup that can't be switched to.
+
+        Returns:
+            A generator of (workgroup_name, samples) tuples, where samples is a list of dicts
+            holding one page of samples from that workgroup.
+
+        """
+
+        self.failed_workgroups = []
         token = utils.getToken(self.get_token_url, username=self.username, password=self.password)
-         
+
         for workgroup_name in self.workgroup_names:
             # Get the first token, set the workgroup, get the 2nd token, and THEN the samples
-            if (utils.setWorkgroup(self.endpoint_url, token, workgroup_name)):
+            if (utils.setWorkgroup(self.endpoint_url, token, workgroup_name, cacheFile=self.workgroup_cache_file,
+                    cacheTtlSeconds=self.workgroup_cache_ttl)):
                 token2 = utils.getToken(self.get_token_url, username=self.username, password=self.password)
             else:
                 logging.error(f"Couldn't set workgroup and get token for workgroup {workgroup_name}")
+                self.failed_workgroups.append(workgroup_name)
+                if strict:
+                    raise RuntimeError(f"Couldn't set workgroup {workgroup_name}")
                 continue
-                
+
             # We can't get all the samples from Climb at once due to the PageSize limit. Instead, we have to make successive
             # calls, incrementing the PageNumber each time, until we get fewer samples than the page size, which is set
             # in the config file.
             page_number=1
             logging.info(f"Getting climb samples for workgroup {workgroup_name}...")
-            samples = []
+            num_samples = 0
             while True:
                 curr_samples = utils.getSamples(self.endpoint_url, token2, all_response=True, PageSize=self.page_size,
                     PageNumber=page_number).get("data").get("items")
-                samples += curr_samples
+                num_samples += len(curr_samples)
+                yield workgroup_name, curr_samples
                 if len(curr_samples) < self.page_size:
                     # Stop when we find fewer samples than the page size.
-                    logging.info(f"Found {len(samples)} samples in Climb.")
-                    all_samples += samples
+                    logging.info(f"Found {num_samples} samples in Climb.")
                     break
                 page_number += 1
-        return all_samples
                 
 
 if __name__ == "__main__":
@@ -7,38 +7,128 @@ import configparser
 import datetime
 import logging
 import os, sys
+import pathlib
+from typing import List
 
-import ClimbSamples
-import Emailer
-import LabGuruBioCollections
+import typer
+
+import RunProfiler
+import SampleNameIndex
+
+# ClimbSamples, Emailer and LabGuruBioCollections are imported when first used, as they pull in
+# requests and smtplib, and quick commands like --count never need them.
 
 class ClimbToLabGuruExporter:
 
-    def __init__(self):
+    def __init__(self, workgroup_names=None, sample_types=None, collections=None, delete_duplicates=True,
+            concurrency=1, dry_run=False, config=None, setup_logger=True):
     
-        """ Add all samples in Climbto LabGuru if not already present. """
+        """
+
+        Add all samples in Climbto LabGuru if not already present.
+
+        Parameters:
+
+            workgroup_names (list): If given, only these Climb workgroups are exported.
+
+            sample_types (list): If given, only Climb samples of these types are exported.
+
+            collections (list): If given, only samples belonging in these LabGuru collections, named by
+                short type (e.g. "liver"), are exported.
+
+            delete_duplicates (bool): Whether to delete duplicate samples found in LabGuru.
+
+            concurrency (int): The number of LabGuru collections downloaded at once.
+
+            dry_run (bool): Log the samples that would be added and deleted, without changing LabGuru.
+
+            config (ConfigParser): If given, used instead of the config file.
+
+            setup_logger (bool): Whether to log to a new file in the log directory. Turn off when the
+                caller has already set up logging.
+
+        Nothing is read from Climb or LabGuru until it is first needed.
+
+        """
         
         # Load config file, which is in the same directory as the source code.
-        config = configparser.ConfigParser()
-        src_dir = os.path.dirname(os.path.abspath(__file__))
-        config.read(os.path.join(src_dir, "config.cfg"))
+        if config is None:
+            config = configparser.ConfigParser()
+            src_dir = os.path.dirname(os.path.abspath(__file__))
+            config.read(os.path.join(src_dir, "config.cfg"))
+        self.config = config
 
         # As this is our "main" file, we need to set up a logger.
-        self.__setup_logger(config)
+        if setup_logger:
+            self.__setup_logger(config)
         
         # Get the name of the sentinal file to be written upon completion of the export.
         self.sentinal_filename = config["logging"]["sentinal_file"]
-        
-        try:
-            self.climb_samples = ClimbSamples.ClimbSamples()
-            self.emailer = Emailer.Emailer()
-            self.labguru_collections = LabGuruBioCollections.LabGuruBioCollections()
-        except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            logging.error(f"{exc_type}\n{fname}\n{exc_tb.tb_lineno}")
-        
-        
+
+        # A run can be limited to some sample types or collections. Only the collections those need are loaded.
+        self.workgroup_names = workgroup_names
+        self.sample_types = set(sample_types) if sample_types else None
+        self.collections = set(collections) if collections else None
+        self.delete_duplicates = delete_duplicates
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+
+        # Samples already in LabGuru can be filtered out in bulk, before the per-sample checks. The
+        # index is rebuilt from a full snapshot, so it isn't used when only some collections are loaded.
+        self.prefilter = (config.getboolean("index", "prefilter", fallback=False) and self.sample_types is None
+            and self.collections is None)
+        self.name_index = SampleNameIndex.SampleNameIndex(config["index"]["name_index_file"])
+
+        # The clients are made on first use.
+        self._climb_samples = None
+        self._emailer = None
+        self._labguru_collections = None
+
+
+    @property
+    def climb_samples(self):
+
+        """ The client for getting samples from Climb. """
+
+        if self._climb_samples is None:
+            import ClimbSamples
+            self._climb_samples = ClimbSamples.ClimbSamples(self.workgroup_names, config=self.config)
+        return self._climb_samples
+
+
+    @property
+    def emailer(self):
+
+        """ The emailer that reports the samples added. """
+
+        if self._emailer is None:
+            import Emailer
+            self._emailer = Emailer.Emailer(config=self.config)
+            if self.workgroup_names:
+                self._emailer.climb_workgroups = list(self.workgroup_names)
+        return self._emailer
+
+
+    @property
+    def labguru_collections(self):
+
+        """ The LabGuru collections, loaded and with duplicates deleted. """
+
+        if self._labguru_collections is None:
+            import LabGuruBioCollections
+            short_types = self.__get_selected_short_types()
+            labguru_collections = LabGuruBioCollections.LabGuruBioCollections(delete_duplicates=self.delete_duplicates,
+                short_types=short_types, concurrency=self.concurrency, dry_run=self.dry_run, config=self.config)
+            labguru_collections.load()
+            # Rebuild the index from the fresh snapshot, so it is never staler than this run.
+            if self.prefilter:
+                self.name_index.build(labguru_collections.iter_tracked_samples(in_key_order=True), presorted=True)
+                if labguru_collections.journal:
+                    labguru_collections.journal.checkpoint(self.name_index.index_path)
+            self._labguru_collections = labguru_collections
+        return self._labguru_collections
+
+
     def add_all_samples_to_labguru(self, samples):
     
         """
@@ -49,11 +139,14 @@ class ClimbToLabGuruExporter:
             samples (list): A list of dicts, where each dict represents one sample.
             
         Returns:
-            None.
+            num_samples_added (int): The number of samples added, or None if adding failed.
             
         """
         
         try:
+            if self.prefilter:
+                samples = self.name_index.filter_unknown(samples, self.labguru_collections.get_short_type)
+
             num_samples_added = 0
             for sample in samples:
                 # Attempt to add each sample. If successful, also keep track in the emailer, 
@@ -63,6 +156,7 @@ class ClimbToLabGuruExporter:
                     num_samples_added +=1
                     self.emailer.add_sample(sample["type"], sample["name"])
             logging.info(f"Added {num_samples_added} new samples.")
+            return num_samples_added
                         
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -77,26 +171,83 @@ class ClimbToLabGuruExporter:
         try:
             samples =  self.climb_samples.get_samples()
             logging.info(f"Found {len(samples)} total samples in Climb.")
+            if self.sample_types is not None or self.collections is not None:
+                samples = [sample for sample in samples if self.__is_selected(sample["type"])]
+                logging.info(f"Kept {len(samples)} samples of the selected types and collections.")
             return samples
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             logging.error(f"{exc_type}\n{fname}\n{exc_tb.tb_lineno}")
 
+    def close_journal(self):
+
+        """ Sync and close the LabGuru journal, if one was opened, so this run's records are on disk. """
+
+        if self._labguru_collections is not None and self._labguru_collections.journal:
+            self._labguru_collections.journal.close()
+
+
+    def count_indexed_samples(self):
+
+        """
+
+        Count the samples in each collection as of the last run, from the name index, without any network calls.
+
+        Returns:
+
+            counts (dict): Maps each short type to its number of samples.
+
+        """
+
+        counts = {}
+        for short_type, name, sample_id in self.name_index.iter_entries():
+            counts[short_type] = counts.get(short_type, 0) + 1
+        return counts
+
+
     def send_report(self):
     
         """ Email a report of all samples added. """
         
+        if self.dry_run:
+            logging.info(f"Dry run, not sending report:\n{self.emailer.get_report_body()}")
+            return
         self.emailer.send_report()
         
         
     def write_sentinal_file(self):
         
         """ Write the sentinal file, marking the job as done. """
-        with open(self.self.sentinal_filename, 'w') as f:
+        sentinal_dir = os.path.dirname(self.sentinal_filename)
+        if sentinal_dir and not os.path.isdir(sentinal_dir):
+            os.makedirs(sentinal_dir, exist_ok=True)
+        with open(self.sentinal_filename, 'w') as f:
             f.write("Job done.")
             
 
+    def __get_selected_short_types(self):
+
+        """ Get the short types of the collections this run needs, or None if it needs all of them. """
+
+        import LabGuruBioCollections
+        short_types = set(self.collections or [])
+        short_types.update(LabGuruBioCollections.get_short_type(x) for x in self.sample_types or [])
+        return short_types or None
+
+
+    def __is_selected(self, sample_type):
+
+        """ Determine whether samples of this type are in the types and collections selected for this run. """
+
+        import LabGuruBioCollections
+        if self.sample_types is not None and sample_type not in self.sample_types:
+            return False
+        if self.collections is not None and LabGuruBioCollections.get_short_type(sample_type) not in self.collections:
+            return False
+        return True
+
+
     def __setup_logger(self, config):
 
         """ Setup logger. """
@@ -124,16 +275,59 @@ class ClimbToLabGuruExporter:
             format='%(asctime)s %(levelname)s: %(message)s')
 
 
-if __name__ == "__main__":
+def main(
+        workgroup: List[str] = typer.Option(None, "--workgroup", "-w",
+            help="A Climb workgroup to export. May be repeated. Defaults to those in the config file."),
+        sample_type: List[str] = typer.Option(None, "--sample-type", "-t",
+            help="A Climb sample type to export, e.g. 'Kidney Left'. May be repeated. Defaults to all."),
+        collection: List[str] = typer.Option(None, "--collection", "-c",
+            help="A LabGuru collection to export to, by short type, e.g. 'liver'. May be repeated. Defaults to all."),
+        dedup: bool = typer.Option(True, "--dedup/--no-dedup", help="Delete duplicate samples found in LabGuru."),
+        dedup_only: bool = typer.Option(False, "--dedup-only", help="Only delete duplicates, don't export anything."),
+        concurrency: int = typer.Option(1, "--concurrency", min=1, help="The number of LabGuru collections downloaded at once."),
+        dry_run: bool = typer.Option(False, "--dry-run", help="Log what would be added and deleted, without changing LabGuru."),
+        count: bool = typer.Option(False, "--count", help="Print the samples per collection as of the last run, and exit."),
+        profile: bool = typer.Option(False, "--profile", help="Profile each phase of the run.")):
+
+    """ Add all samples in Climb to LabGuru if not already present, and email a report of the samples added. """
+
+    # Profiling is turned on by the config file, or by passing --profile.
+    profiler = RunProfiler.RunProfiler(enabled=True if profile else None)
     try:
-        exporter = ClimbToLabGuruExporter()
-        samples = exporter.get_all_samples_from_climb()
-        exporter.add_all_samples_to_labguru(samples)
-        exporter.send_report()
-        exporter.write_sentinal_file()
+        with profiler.phase("setup"):
+            exporter = ClimbToLabGuruExporter(workgroup_names=workgroup, sample_types=sample_type,
+                collections=[x.lower() for x in collection or []], delete_duplicates=dedup or dedup_only,
+                concurrency=concurrency, dry_run=dry_run, setup_logger=not count)
+        # Counting only reads the local index and prints, so it doesn't get a log file.
+        if count:
+            for short_type, num_samples in sorted(exporter.count_indexed_samples().items()):
+                print(f"{short_type}: {num_samples}")
+            return
+        if dedup_only:
+            # Loading the collections deletes their duplicates.
+            with profiler.phase("dedup"):
+                exporter.labguru_collections
+            exporter.close_journal()
+            return
+        with profiler.phase("get_climb_samples"):
+            samples = exporter.get_all_samples_from_climb()
+        # Loading LabGuru is lazy. Load it here, so its time isn't counted as adding samples.
+        with profiler.phase("load_labguru"):
+            exporter.labguru_collections
+        with profiler.phase("add_samples"):
+            exporter.add_all_samples_to_labguru(samples)
+        exporter.close_journal()
+        with profiler.phase("send_report"):
+            exporter.send_report()
+        # The sentinal file marks the scheduled, full export as done, so targeted re-runs don't write it.
+        if not (workgroup or sample_type or collection or dry_run):
+            exporter.write_sentinal_file()
         
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
         fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
         logging.error(f"{exc_type} in {fname}:{exc_tb.tb_lineno}")
-    
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,240 @@
+#!/usr/env/bin python
+
+# Export the Climb samples and the LabGuru snapshot to local files, and summarize
+# those files, so questions about the data don't require pulling from the APIs again.
+
+import argparse
+from collections import Counter
+import configparser
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import logging
+import os
+import sys
+
+# Parquet is used if pyarrow is installed. Otherwise we fall back to gzipped NDJSON.
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# The columns written for each dataset, in order.
+CLIMB_COLUMNS = ["workgroup", "sampleID", "type", "name"]
+LABGURU_COLUMNS = ["collection", "name", "id", "created_at"]
+
+
+class DatasetExporter:
+
+    """ Write Climb and LabGuru samples to columnar or line-delimited files, and summarize them. """
+
+    def __init__(self):
+
+        """ Read config file, initialize data members. """
+
+        # Load config file, which is in the same directory as the source code.
+        config = configparser.ConfigParser()
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        config.read(os.path.join(src_dir, "config.cfg"))
+
+        self.export_dir = config["export"]["export_dir"]
+        self.use_parquet = pyarrow is not None and config.getboolean("export", "use_parquet", fallback=True)
+
+
+    def export_climb(self, climb_samples):
+
+        """
+
+        Write all Climb samples to a file, one page at a time.
+
+        Parameters:
+
+            climb_samples (ClimbSamples): Used to page through the samples in Climb.
+
+        Returns:
+
+            export_path (str): The full path of the file written.
+
+        """
+
+        def rows():
+            for workgroup_name, curr_samples in climb_samples.iter_sample_pages():
+                yield [[workgroup_name, sample.get("sampleID"), sample.get("type"), sample.get("name")]
+                    for sample in curr_samples]
+
+        return self.__write("climb_samples", CLIMB_COLUMNS, rows())
+
+
+    def export_labguru(self, labguru_collections, batch_size=10000):
+
+        """
+
+        Write the LabGuru snapshot to a file, including any duplicates not yet deleted.
+
+        Parameters:
+
+            labguru_collections (LabGuruBioCollections): Holds every sample already in LabGuru.
+
+            batch_size (int): The number of samples written at a time.
+
+        Returns:
+
+            export_path (str): The full path of the file written.
+
+        """
+
+        def rows():
+            batch = []
+            samples = itertools.chain(labguru_collections.iter_tracked_samples(),
+                labguru_collections.iter_duplicate_samples())
+            for tracked in samples:
+                batch.append(list(tracked))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        return self.__write("labguru_samples", LABGURU_COLUMNS, rows())
+
+
+    def summarize(self, export_path):
+
+        """
+
+        Count the samples in an exported file per type and per workgroup, and count duplicates.
+
+        Parameters:
+
+            export_path (str): A file written by export_climb or export_labguru.
+
+        Returns:
+
+            summary (dict): Maps each summarized column, and "duplicates", to a dict of value counts.
+
+        """
+
+        if export_path.endswith(".parquet"):
+            return self.__summarize_parquet(export_path)
+        return self.__summarize_ndjson(export_path)
+
+
+    def __group_columns(self, columns):
+
+        """ Get the columns to count by, and the columns that identify a sample, for a dataset. """
+
+        if "workgroup" in columns:
+            return ["type", "workgroup"], ["type", "name"]
+        return ["collection"], ["collection", "name"]
+
+
+    def __summarize_ndjson(self, export_path):
+
+        """ Summarize a gzipped NDJSON export by streaming it once. """
+
+        counters = None
+        with gzip.open(export_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                if counters is None:
+                    count_columns, key_columns = self.__group_columns(row.keys())
+                    counters = { column : Counter() for column in count_columns }
+                    name_counts = Counter()
+                for column in count_columns:
+                    counters[column][row[column]] += 1
+                name_counts[tuple(row[column] for column in key_columns)] += 1
+
+        if counters is None:
+            return {}
+        counters["duplicates"] = Counter()
+        for key, count in name_counts.items():
+            if count > 1:
+                counters["duplicates"][key[0]] += 1
+        return { column : dict(counter) for column, counter in counters.items() }
+
+
+    def __summarize_parquet(self, export_path):
+
+        """ Summarize a Parquet export with Arrow compute kernels. """
+
+        table = pyarrow.parquet.read_table(export_path)
+        count_columns, key_columns = self.__group_columns(table.column_names)
+
+        summary = {}
+        for column in count_columns:
+            counts = pyarrow.compute.value_counts(table[column]).to_pylist()
+            summary[column] = { count["values"] : count["counts"] for count in counts }
+
+        # Count the names that appear more than once within each type.
+        grouped = table.group_by(key_columns).aggregate([(key_columns[1], "count")])
+        dups = grouped.filter(pyarrow.compute.greater(grouped[key_columns[1] + "_count"], 1))
+        counts = pyarrow.compute.value_counts(dups[key_columns[0]]).to_pylist()
+        summary["duplicates"] = { count["values"] : count["counts"] for count in counts }
+        return summary
+
+
+    def __write(self, dataset_name, columns, batches):
+
+        """ Write batches of rows to a new file in the export directory, and return its path. """
+
+        if not os.path.isdir(self.export_dir):
+            os.makedirs(self.export_dir, exist_ok=True)
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        extension = ".parquet" if self.use_parquet else ".ndjson.gz"
+        export_path = os.path.join(self.export_dir, dataset_name + "_" + timestamp + extension)
+
+        num_rows = 0
+        if self.use_parquet:
+            schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+            with pyarrow.parquet.ParquetWriter(export_path, schema) as writer:
+                for batch in batches:
+                    # Everything is written as a string, since ids come back from the APIs as either.
+                    arrays = [pyarrow.array([None if row[i] is None else str(row[i]) for row in batch], pyarrow.string())
+                        for i in range(len(columns))]
+                    writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                    num_rows += len(batch)
+        else:
+            with gzip.open(export_path, 'wt', encoding='utf-8') as f:
+                for batch in batches:
+                    for row in batch:
+                        f.write(json.dumps(dict(zip(columns, row))) + "\n")
+                    num_rows += len(batch)
+
+        logging.info(f"Exported {num_rows} {dataset_name} to {export_path}")
+        return export_path
+
+
+if __name__ == "__main__":
+
+    # Run by itself, this code either exports the datasets or summarizes an exported file.
+
+    parser = argparse.ArgumentParser(description="Export Climb and LabGuru samples, or summarize an export.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export samples from Climb and/or LabGuru.")
+    export_parser.add_argument("--source", choices=["climb", "labguru", "both"], default="both")
+    summary_parser = subparsers.add_parser("summary", help="Print counts per type, per workgroup, and duplicates.")
+    summary_parser.add_argument("export_path")
+    args = parser.parse_args()
+
+    exporter = DatasetExporter()
+    if args.command == "export":
+        if args.source in ("climb", "both"):
+            import ClimbSamples
+            print(exporter.export_climb(ClimbSamples.ClimbSamples()))
+        if args.source in ("labguru", "both"):
+            import LabGuruBioCollections
+            # A snapshot is read-only, so keep the duplicates, and export them along with the rest.
+            print(exporter.export_labguru(LabGuruBioCollections.LabGuruBioCollections(delete_duplicates=False)))
+    else:
+        writer = csv.writer(sys.stdout, delimiter='\t')
+        for column, counts in exporter.summarize(args.export_path).items():
+            writer.writerow([column, "count"])
+            for value in sorted(counts, key=str):
+                writer.writerow([value, counts[value]])
+            writer.writerow([])
@@ -0,0 +1,171 @@
+#!/usr/env/bin python
+
+# A disk-backed alternative to LabGuruBioCollections' in-memory sample tracker, for collections
+# too large to hold every sample name in memory.
+
+import logging
+import os
+import sqlite3
+
+
+class DiskSampleIndex:
+
+    """
+
+    Track the samples in LabGuru in an SQLite database, read through a memory map.
+
+    The samples table is keyed by (short_type, name) without a rowid, so it is itself a covering
+    index: existence checks and per-type name scans never touch anything else. As with the
+    in-memory tracker, only the oldest sample of each type and name is kept, and the newer ones
+    are recorded as duplicates to be deleted.
+
+    """
+
+    def __init__(self, db_path, mmap_bytes=256 * 1024 * 1024, cache_kb=64 * 1024):
+
+        """
+
+        Open the database, creating it if needed.
+
+        Parameters:
+
+            db_path (str): The full path of the database file.
+
+            mmap_bytes (int): The most of the database file that is memory mapped.
+
+            cache_kb (int): The most memory used for SQLite's page cache, which bounds our RAM.
+
+        """
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(f"PRAGMA mmap_size = {int(mmap_bytes)}")
+        self.connection.execute(f"PRAGMA cache_size = -{int(cache_kb)}")
+        self.connection.execute("PRAGMA temp_store = FILE")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS samples (short_type TEXT NOT NULL, name TEXT NOT NULL,
+            id, created_at, PRIMARY KEY (short_type, name)) WITHOUT ROWID""")
+        self.connection.commit()
+
+
+    def add(self, short_type, name, sample_id, created_at):
+
+        """ Track a sample newly added to LabGuru. """
+
+        self.connection.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)",
+            (short_type, name, sample_id, created_at))
+        self.connection.commit()
+
+
+    def add_page(self, short_type, samples):
+
+        """
+
+        Stage one page of samples downloaded from a collection. Call begin_build first, and
+        finish_build once every page has been staged.
+
+        Parameters:
+
+            short_type (str): The short type of the collection the page came from.
+
+            samples (list): The sample dicts on the page, each with a name, id, created_at and description.
+
+        """
+
+        self.connection.executemany("INSERT INTO staged VALUES (?, ?, ?, ?, ?)",
+            ((short_type, sample["name"], sample["id"], sample["created_at"], sample.get("description")) for sample in samples))
+
+
+    def begin_build(self):
+
+        """ Clear the index, ready to stage a full snapshot of LabGuru with add_page. """
+
+        self.connection.execute("DROP TABLE IF EXISTS staged")
+        self.connection.execute("CREATE TABLE staged (short_type TEXT, name TEXT, id, created_at, description)")
+        self.connection.execute("DELETE FROM samples")
+        self.connection.execute("DROP TABLE IF EXISTS duplicates")
+        self.connection.execute("""CREATE TABLE duplicates (short_type TEXT NOT NULL, name TEXT NOT NULL, id, created_at,
+            description)""")
+
+
+    def contains(self, short_type, name):
+
+        """ Find whether a sample of this short type and name is tracked. """
+
+        return self.get(short_type, name) is not None
+
+
+    def count(self, short_type):
+
+        """ Get the number of samples tracked of the given short type. """
+
+        return self.connection.execute("SELECT COUNT(*) FROM samples WHERE short_type = ?", (short_type,)).fetchone()[0]
+
+
+    def finish_build(self):
+
+        """
+
+        Keep the oldest of each staged sample's type and name, and record the rest as duplicates.
+
+        Ties in created_at go to the sample staged first, the same as the in-memory tracker.
+
+        Returns:
+
+            num_samples (int): The number of samples staged.
+
+        """
+
+        ranked = """SELECT short_type, name, id, created_at, description, ROW_NUMBER() OVER
+            (PARTITION BY short_type, name ORDER BY created_at, rowid) AS rank FROM staged"""
+        self.connection.execute(f"INSERT INTO samples SELECT short_type, name, id, created_at FROM ({ranked}) WHERE rank = 1")
+        self.connection.execute(f"INSERT INTO duplicates SELECT short_type, name, id, created_at, description FROM ({ranked}) WHERE rank > 1")
+        num_samples = self.connection.execute("SELECT COUNT(*) FROM staged").fetchone()[0]
+        self.connection.execute("DROP TABLE staged")
+        self.connection.commit()
+        logging.info(f"Built disk index {self.db_path} from {num_samples} samples.")
+        return num_samples
+
+
+    def get(self, short_type, name):
+
+        """ Get the tracked sample as a dict with its id and created_at, or None if it isn't tracked. """
+
+        row = self.connection.execute("SELECT id, created_at FROM samples WHERE short_type = ? AND name = ?",
+            (short_type, name)).fetchone()
+        return { 'id' : row[0], 'created_at' : row[1] } if row else None
+
+
+    def iter_duplicates(self):
+
+        """ Iterate over the (short_type, id, name, created_at, description) of every duplicate found by the last build. """
+
+        yield from self.connection.execute("SELECT short_type, id, name, created_at, description FROM duplicates")
+
+
+    def iter_names(self, short_type):
+
+        """ Iterate over the names of all samples of the given short type, in sorted order. """
+
+        for row in self.connection.execute("SELECT name FROM samples WHERE short_type = ? ORDER BY name", (short_type,)):
+            yield row[0]
+
+
+    def iter_samples(self, ordered=False):
+
+        """
+
+        Iterate over the (short_type, name, id, created_at) of every tracked sample.
+
+        Parameters:
+
+            ordered (bool): Whether to order them by short type and then name. This is the primary
+                key's order, so it costs no sort.
+
+        """
+
+        query = "SELECT short_type, name, id, created_at FROM samples"
+        yield from self.connection.execute(query + " ORDER BY short_type, name" if ordered else query)
@@ -17,21 +17,22 @@ class Emailer:
     Format reports and send email notifications to recipients.
     """
 
-    def __init__(self):
+    def __init__(self, config=None):
 
         """
-        Read and parse config file
+        Read and parse config file, unless a parsed config is given
         """
 
         # Load config file, which is in the same directory as the source code.
-        config = configparser.ConfigParser()
-        src_dir = os.path.dirname(os.path.abspath(__file__))
-        config.read(os.path.join(src_dir, "config.cfg"))
+        if config is None:
+            config = configparser.ConfigParser()
+            src_dir = os.path.dirname(os.path.abspath(__file__))
+            config.read(os.path.join(src_dir, "config.cfg"))
 
         self.mail_conf = config["emailer"]
 
-        # The domain and port number are fixed constants
-        self.smtp_obj = smtplib.SMTP(self.mail_conf["smtp_address"], self.mail_conf["smtp_port"])
+        # The connection to the SMTP server is opened when the report is sent.
+        self.smtp_obj = None
 
         # Keep a collection of all samples added as a dict of lists, where each key is a sample
         # type and the value is a list of all samples of that type. 
@@ -0,0 +1,81 @@
+#!/usr/env/bin python
+
+# A single HTTP session shared by every call to Climb and LabGuru, so connections are pooled
+# and reused, and so the rate of requests from this process can be limited.
+
+from http.cookiejar import DefaultCookiePolicy
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RateLimitedSession(requests.Session):
+
+    """ A requests session with a pool of connections per host, and a limit on requests per second. """
+
+    def __init__(self, requests_per_second=None, pool_size=10):
+
+        """
+
+        Initialize the session.
+
+        Parameters:
+
+            requests_per_second (float): The most requests started per second, across all threads. None for no limit.
+
+            pool_size (int): The most connections kept open to each host.
+
+        """
+
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+        # Every call carries its own credentials. Don't let cookies from one account leak into calls for another.
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        self.min_interval = 1.0 / requests_per_second if requests_per_second else 0
+        self._next_start = 0
+        self._lock = threading.Lock()
+
+
+    def request(self, *args, **kwargs):
+
+        """ Make a request, first waiting for our turn if requests are rate limited. """
+
+        if self.min_interval:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._next_start - now
+                self._next_start = max(now, self._next_start) + self.min_interval
+            if wait > 0:
+                time.sleep(wait)
+        return super().request(*args, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(requests_per_second=None, pool_size=10):
+
+    """ Replace the shared session with one using the given rate limit and pool size. """
+
+    global _session
+    with _session_lock:
+        _session = RateLimitedSession(requests_per_second, pool_size)
+    return _session
+
+
+def get_session():
+
+    """ Get the shared session, making it with no rate limit if it hasn't been configured. """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = RateLimitedSession()
+        return _session
@@ -4,27 +4,52 @@
 # collections in LabGuru
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import configparser
 import json
 import logging
-import requests
+import queue
 import os
 import sys
+import threading
 import urllib
 
+import DiskSampleIndex
+import HttpClient
+import MutationJournal
+
 
 class LabGuruBioCollections:
 
     """ Query and update our custom inventory collections in LabGuru """
 
-    def __init__(self):
+    def __init__(self, delete_duplicates=True, short_types=None, concurrency=1, dry_run=False, config=None):
+
+        """
+
+        Parse config file and read tokens. The samples already in Labguru are loaded on first use,
+        or by calling load.
+
+        Parameters:
+
+            delete_duplicates (bool): Whether to delete newer samples with the same name as an older one.
+
+            short_types (list): If given, only the collections for these short types are loaded.
+
+            concurrency (int): The number of collections downloaded at once.
 
-        """ Parse config file, read tokens. """
+            dry_run (bool): Log the samples that would be added and deleted, without changing Labguru.
+
+            config (ConfigParser): If given, used instead of the config file.
+
+        """
         
 	    # Load config file, which is in the same directory as the source code.
-        self.config = configparser.ConfigParser()
-        src_dir = os.path.dirname(os.path.abspath(__file__))
-        self.config.read(os.path.join(src_dir, "config.cfg"))
+        self.config = config
+        if self.config is None:
+            self.config = configparser.ConfigParser()
+            src_dir = os.path.dirname(os.path.abspath(__file__))
+            self.config.read(os.path.join(src_dir, "config.cfg"))
 		
         self.request_headers = { 'accept': 'application/json',
             'Content-Type': 'application/json' }
@@ -46,6 +71,11 @@ class LabGuruBioCollections:
 
         # Get the page size for requests
         self.page_size = self.config["constants"]["labguru_page_size"]
+
+        self.short_types = set(short_types) if short_types else None
+        self.concurrency = max(1, int(concurrency))
+        self.delete_duplicates = delete_duplicates
+        self.dry_run = dry_run
         
         # We'll need to map sample short types back to their URLs.
         self._url_lookup = {}
@@ -59,12 +89,21 @@ class LabGuruBioCollections:
         # only the oldest sample of that name and type. Duplicate samples with newer creation times will 
         # have their ids appended to a list to be deleted.
         self._sample_tracker = defaultdict(dict)
-        # For each type of sample, keep a list of list of duplicates we'll need to delete.
+        # For each type of sample, keep a list of (id, name) of duplicates we'll need to delete.
         self._dups_to_delete = defaultdict(list)
+
+        # For very large collections, the tracker can instead be kept on disk. Duplicates are still
+        # listed in memory, as there are few of them.
+        self._disk_index = None
+        if self.config.get("labguru_index", "backend", fallback="memory") == "sqlite":
+            self._disk_index = DiskSampleIndex.DiskSampleIndex(self.config["labguru_index"]["db_path"],
+                mmap_bytes=int(float(self.config["labguru_index"]["mmap_mb"]) * 1024 * 1024))
+
+        # Every sample we add or delete is journaled, if the journal is enabled.
+        self.journal = MutationJournal.from_config(self.config)
     
-        # We need to load the existing samples for the above to happen.
-        self.__load_existing_samples()
-        self.__delete_duplicates()
+        # We need to load the existing samples for the above to happen. That is put off until they're needed.
+        self._loaded = False
         
 
 
@@ -89,6 +128,8 @@ class LabGuruBioCollections:
         if self.__skip_samples(sample_type):
             logging.debug(f"Skipping sample {sample_name} due to skipped type {sample_type}")
             return False
+
+        self.load()
             
         if self.sample_exists(sample_type, sample_name):
             logging.debug(f"Sample {sample_name} of type {sample_type} already exists, skipping.")
@@ -99,29 +140,57 @@ class LabGuruBioCollections:
             return False
             
         desc = self.get_description(sample_type)
-         
-        payload = { "token" : self.token,
-            "item": {
-                "name": sample_name,
-                "description": desc
-            }
-        }
-        logging.debug(f"Attempting to add sample {sample_name} of type {sample_type}...")
-        response = requests.request("POST", url, headers=self.request_headers,
+        return self.__post_sample(self.__get_short_type(sample_type), url, sample_name, desc)
+
+
+    def archive_sample(self, short_type, sample_name):
+
+        """
+
+        Archive a sample in Labguru, leaving it in its collection but hidden from normal use.
+
+        Parameters:
+
+            short_type (str): The short type of the sample's collection.
+
+            sample_name (str): The sample's name.
+
+        Returns:
+
+            Bool : True if archived, false if not.
+
+        """
+
+        self.load()
+        tracked = self.__get_tracked(short_type, sample_name)
+        if not tracked:
+            logging.error(f"Cannot archive sample {sample_name} of type {short_type}, it is not in Labguru.")
+            return False
+
+        url = self.__get_url_from_short_type(short_type) + '/' + str(tracked['id'])
+        payload = { "token" : self.token, "item" : { "archived" : True } }
+        logging.debug(f"Attempting to archive sample {sample_name} of type {short_type}. Url is: {url}")
+        response = HttpClient.get_session().request("PUT", url, headers=self.request_headers,
             json = payload).text.encode('utf-8').decode("utf-8")
-        
-        # A successful request should return a json dict. Confirm it contains a valid auto_name
-        # generated by LabGuru for the new sample.
+
+        # As with adding, a successful request returns the item as a json dict.
         try:
-            auto_name = json.loads(response)["auto_name"]
-            logging.info(f"Successfully added sample {sample_name} of type {sample_type}.")
+            json.loads(response)["id"]
+            logging.info(f"Archived sample {sample_name} of type {short_type}.")
             return True
         except Exception:
-            logging.error(f"Could not add sample {sample_name} of type {sample_type}. Response: {response}")
+            logging.error(f"Could not archive sample {sample_name} of type {short_type}. Response: {response}")
 
         return False
-        
-        
+
+
+    def get_collection_short_types(self):
+
+        """ Get the short types of all collections we have in Labguru. """
+
+        return [short_type for short_type in self._url_lookup if short_type != "base_url"]
+
+
     def get_description(self, sample_type):
     
         """ Get the description to be added to the sample. """
@@ -143,6 +212,13 @@ class LabGuruBioCollections:
         return desc
 
 
+    def get_short_type(self, sample_type):
+
+        """ Get the short type, which names a collection, for a Climb sample type. """
+
+        return self.__get_short_type(sample_type)
+
+
     def get_url(self, sample_type):
     
         """ Get the custom collection URL for adding samples of the given type. """
@@ -159,15 +235,126 @@ class LabGuruBioCollections:
             return None
             
         return url
-	
-    
+
+
+    def iter_duplicate_samples(self):
+
+        """
+
+        Iterate over every duplicate found in Labguru, the newer samples sharing a type and name.
+
+        Returns:
+
+            A generator of (short_type, name, id, created_at) tuples.
+
+        """
+
+        self.load()
+        for short_type, dups in self._dups_to_delete.items():
+            for sample_id, sample_name, created_at, _ in dups:
+                yield short_type, sample_name, sample_id, created_at
+
+
+    def iter_sample_names(self, short_type):
+
+        """ Iterate over the names of all samples in Labguru of the given short type, in sorted order. """
+
+        self.load()
+        if self._disk_index:
+            yield from self._disk_index.iter_names(short_type)
+            return
+        yield from sorted(self._sample_tracker[short_type])
+
+
+    def iter_tracked_samples(self, in_key_order=False):
+
+        """
+
+        Iterate over every sample already in Labguru, after duplicates have been removed.
+
+        Parameters:
+
+            in_key_order (bool): Whether to order the samples by short type and then name, as
+                SampleNameIndex expects. The disk index streams them in this order at no cost.
+
+        Returns:
+
+            A generator of (short_type, name, id, created_at) tuples.
+
+        """
+
+        self.load()
+        if self._disk_index:
+            yield from self._disk_index.iter_samples(ordered=in_key_order)
+            return
+
+        short_types = sorted(self._sample_tracker) if in_key_order else self._sample_tracker
+        for short_type in short_types:
+            samples = self._sample_tracker[short_type]
+            sample_names = sorted(samples) if in_key_order else samples
+            for sample_name in sample_names:
+                tracked = samples[sample_name]
+                yield short_type, sample_name, tracked['id'], tracked['created_at']
+
+
+    def is_skipped(self, sample_type):
+
+        """ Determine whether samples of the given type are skipped rather than exported. """
+
+        return self.__skip_samples(sample_type)
+
+
+    def load(self):
+
+        """ Load the samples already in Labguru and delete duplicates, unless that was already done. """
+
+        if self._loaded:
+            return
+        self._loaded = True
+        self.__load_existing_samples()
+        if self.delete_duplicates:
+            self.__delete_duplicates()
+
+
+    def restore_sample(self, short_type, sample_name, description=None):
+
+        """
+
+        Add a sample back into Labguru after it was deleted, even if one of that name exists.
+
+        Parameters:
+
+            short_type (str): The short type of the sample's collection.
+
+            sample_name (str): The sample's name.
+
+            description (str): The sample's description when it was deleted. If not given, the
+                collection's default description is used.
+
+        Returns:
+
+            Bool : True if added, false if not.
+
+        """
+
+        if description is None:
+            description = self.sample_descriptions.get(short_type)
+        try:
+            url = self.__get_url_from_short_type(short_type)
+        except KeyError:
+            logging.error(f"Sample type {short_type} not found in sample collections")
+            return False
+        return self.__post_sample(short_type, url, sample_name, description)
+
+
     def sample_exists(self, sample_type, sample_name):
     
         """ Find whether this sample already exists in LabGuru. """
 
         # All existing samples were indexed by their short_type.
+        self.load()
         short_type = self.__get_short_type(sample_type)
-        val = sample_name in self._sample_tracker[short_type]
+        val = self.__get_tracked(short_type, sample_name) is not None
         return val
 
 
@@ -186,21 +373,30 @@ class LabGuruBioCollections:
         
         for short_type, sample_ids in self._dups_to_delete.items():
             url = self.__get_url_from_short_type(short_type)
-            for sample_id in sample_ids:
+            for sample_id, sample_name, _, description in sample_ids:
                 del_url = url + '/' + str(sample_id)
+                if self.dry_run:
+                    logging.info(f"Dry run, would delete dup {short_type}, {sample_name}, {sample_id}.")
+                    continue
                 logging.debug(f"Deleting dup {short_type}, {sample_id}. Url is: {del_url}")
                 payload = { "token" : self.token}
         
-                response = requests.delete(del_url, headers=self.request_headers,
-                    json = payload).text.encode('utf-8').decode("utf-8")
-                logging.debug(f"Response was {str(response)}")
+                response = HttpClient.get_session().delete(del_url, headers=self.request_headers, json = payload)
+                logging.debug(f"Response was {response.text}")
+                # Only journal the deletes LabGuru confirmed, so an undo never re-creates a sample that is still there.
+                if not response.ok:
+                    logging.error(f"Could not delete dup {short_type}, {sample_name}, {sample_id}. "
+                        f"Status {response.status_code}, response: {response.text}")
+                    continue
+                if self.journal:
+                    self.journal.record_delete(short_type, sample_name, sample_id, description)
                 
     def __get_max_pages(self, short_type, full_url):
 
         """ Find how many pages of samples there are for this type. """
         
         payload = { "token" : self.token, "meta" : "true", "page_size": self.page_size}
-        response = requests.request("GET", full_url, headers=self.request_headers,
+        response = HttpClient.get_session().request("GET", full_url, headers=self.request_headers,
             json=payload).text.encode('utf-8').decode("utf-8")
         
         try:
@@ -217,10 +413,18 @@ class LabGuruBioCollections:
     
         """ Get the lowercase first word from the sample with no hyphens."""
         
-        short_type = sample_type.replace('-', ' ').split(' ')[0].lower()
-        return short_type
+        return get_short_type(sample_type)
     
     
+    def __get_tracked(self, short_type, sample_name):
+
+        """ Get the id and created_at of a tracked sample, or None if it isn't in Labguru. """
+
+        if self._disk_index:
+            return self._disk_index.get(short_type, sample_name)
+        return self._sample_tracker[short_type].get(sample_name)
+
+
     def __get_url_from_short_type(self, short_type):
     
         """ Given a short type, return the URL for it's collection. """
@@ -232,44 +436,150 @@ class LabGuruBioCollections:
         """ Find and store the names of all samples already in Labguru. """
         
         total_samples_loaded = 0
-        # For each kind of sample, get a list of existing samples.
+        if self._disk_index:
+            self._disk_index.begin_build()
+
+        # Get the collections to load, leaving out any that weren't asked for.
+        collections = []
         for short_type, url in self.sample_urls.items():
             if short_type == "base_url":
                 continue
-            full_url = (self.base_url + url).replace(' ', '%20')
- 
-            logging.debug(f"Getting samples for {short_type}, url is {full_url}.")
-            num_samples_curr_type = 0
-            curr_page = 0
-            
-            max_num_pages = self.__get_max_pages(short_type, full_url)
-            
-            while curr_page <= max_num_pages:
-                curr_page +=1
-                payload = { "token" : self.token, "meta" : "true", "page_size": self.page_size, "page": curr_page}
-                response = requests.request("GET", full_url, headers=self.request_headers,
-                    json=payload).text.encode('utf-8').decode("utf-8")
-                try:
-                    curr_samples = json.loads(response)['data']
-                except Exception as e:
-                    logging.error(f"Could not load response for {short_type} as json. Received exception {str(e)}. Url was {full_url}")
-                    continue
-                    
-                if not curr_samples:
-                    break
-                logging.debug(f"Loading labguru sampls, found {len(curr_samples)} {short_type} samples on page {curr_page} .")
-               
-                for sample in curr_samples:
-                    if type(sample) is dict:
-                        # We want to track which samples are duplicates that must be deleted.
-                        num_samples_curr_type +=1
-                        total_samples_loaded +=1
-                        self.__track_samples(short_type, sample)
-                    else:
-                        logging.error(f"For {short_type}, found non-dict sample {sample}.")
-            logging.info(f"Loaded {num_samples_curr_type} samples of {short_type}.")
+            if self.short_types is not None and short_type not in self.short_types:
+                continue
+            collections.append((short_type, (self.base_url + url).replace(' ', '%20')))
+
+        # Collections are downloaded on worker threads, which hand their pages back through a bounded
+        # queue. All tracking is done here, on this thread, so the tracker needs no locking. Each
+        # worker finishes a collection by putting a page of None.
+        pages = queue.Queue(maxsize=2 * self.concurrency)
+
+        def fetch(short_type, full_url):
+            try:
+                for curr_samples in self.__iter_collection_pages(short_type, full_url):
+                    pages.put((short_type, curr_samples))
+            finally:
+                pages.put((short_type, None))
+
+        num_samples_by_type = defaultdict(int)
+        # Name the workers after this thread, so their log lines can be told apart when several runs share a process.
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                thread_name_prefix=threading.current_thread().name + "-labguru") as executor:
+            futures = [executor.submit(fetch, short_type, full_url) for short_type, full_url in collections]
+            num_remaining = len(collections)
+            try:
+                while num_remaining:
+                    short_type, curr_samples = pages.get()
+                    if curr_samples is None:
+                        num_remaining -= 1
+                        logging.info(f"Loaded {num_samples_by_type[short_type]} samples of {short_type}.")
+                        continue
+
+                    page_samples = []
+                    for sample in curr_samples:
+                        if type(sample) is dict:
+                            # We want to track which samples are duplicates that must be deleted.
+                            num_samples_by_type[short_type] +=1
+                            total_samples_loaded +=1
+                            if self._disk_index:
+                                page_samples.append(sample)
+                            else:
+                                self.__track_samples(short_type, sample)
+                        else:
+                            logging.error(f"For {short_type}, found non-dict sample {sample}.")
+                    if page_samples:
+                        self._disk_index.add_page(short_type, page_samples)
+            except Exception:
+                # Let the workers finish, or they would block forever on the full queue.
+                while num_remaining:
+                    if pages.get()[1] is None:
+                        num_remaining -= 1
+                raise
+
+            # Surface any error from a worker, as the loop above would have done.
+            for future in futures:
+                future.result()
         logging.info(f"Loaded {total_samples_loaded} existing samples.")
+
+        # The disk index finds the duplicates all at once, after every page is staged.
+        if self._disk_index:
+            self._disk_index.finish_build()
+            for short_type, dup_id, sample_name, created_at, description in self._disk_index.iter_duplicates():
+                self._dups_to_delete[short_type].append((dup_id, sample_name, created_at, description))
+        
+    def __iter_collection_pages(self, short_type, full_url):
+
+        """ Download a collection one page at a time, yielding the list of samples on each page. """
+
+        logging.debug(f"Getting samples for {short_type}, url is {full_url}.")
+        curr_page = 0
+        
+        max_num_pages = self.__get_max_pages(short_type, full_url)
+        
+        while curr_page <= max_num_pages:
+            curr_page +=1
+            payload = { "token" : self.token, "meta" : "true", "page_size": self.page_size, "page": curr_page}
+            response = HttpClient.get_session().request("GET", full_url, headers=self.request_headers,
+                json=payload).text.encode('utf-8').decode("utf-8")
+            try:
+                curr_samples = json.loads(response)['data']
+            except Exception as e:
+                logging.error(f"Could not load response for {short_type} as json. Received exception {str(e)}. Url was {full_url}")
+                continue
+                
+            if not curr_samples:
+                break
+            logging.debug(f"Loading labguru sampls, found {len(curr_samples)} {short_type} samples on page {curr_page} .")
+            yield curr_samples
+
+
+    def __post_sample(self, short_type, url, sample_name, desc):
+
+        """ Post a new sample to its collection's url, and track and journal it if LabGuru accepts it. """
+
+        if self.dry_run:
+            logging.info(f"Dry run, would add sample {sample_name} of type {short_type}.")
+            # Track it anyway, so a repeat of the name later in this run is skipped, as it would be for real.
+            self.__set_tracked(short_type, sample_name, None, None, desc)
+            return True
+
+        payload = { "token" : self.token,
+            "item": {
+                "name": sample_name,
+                "description": desc
+            }
+        }
+        logging.debug(f"Attempting to add sample {sample_name} of type {short_type}...")
+        response = HttpClient.get_session().request("POST", url, headers=self.request_headers,
+            json = payload).text.encode('utf-8').decode("utf-8")
         
+        # A successful request should return a json dict. Confirm it contains a valid auto_name
+        # generated by LabGuru for the new sample.
+        try:
+            new_sample = json.loads(response)
+            auto_name = new_sample["auto_name"]
+        except Exception:
+            logging.error(f"Could not add sample {sample_name} of type {short_type}. Response: {response}")
+            return False
+
+        logging.info(f"Successfully added sample {sample_name} of type {short_type}.")
+        # Track the new sample, so a repeat of the same name later in this run isn't added again.
+        self.__set_tracked(short_type, sample_name, new_sample.get('id'), new_sample.get('created_at'), desc)
+        if self.journal:
+            self.journal.record_create(short_type, sample_name, new_sample.get('id'), auto_name, desc)
+        return True
+
+
+    def __set_tracked(self, short_type, sample_name, sample_id, created_at, description):
+
+        """ Track a sample just added to Labguru, in the disk index or the in-memory tracker. """
+
+        if self._disk_index:
+            self._disk_index.add(short_type, sample_name, sample_id, created_at)
+        else:
+            self._sample_tracker[short_type][sample_name] = { 'id' : sample_id, 'created_at' : created_at,
+                'description' : description }
+
+
     def __skip_samples(self, sample_type):
     
         """ Determine whether given sample type should be skipped. """
@@ -284,12 +594,14 @@ class LabGuruBioCollections:
         sample_name = sample["name"]
         curr_id = sample['id']
         curr_create_time = sample['created_at']
+        curr_description = sample.get('description')
         
         # If we don't yet have this short type or sample in our tracker, insert it as a key, where the
         # val is a dict with the id and 'created_at' time.
         if short_type not in self._sample_tracker or sample_name not in self._sample_tracker[short_type]:
         
-            self._sample_tracker[short_type][sample_name] = { 'id' : curr_id, 'created_at' : curr_create_time }
+            self._sample_tracker[short_type][sample_name] = { 'id' : curr_id, 'created_at' : curr_create_time,
+                'description' : curr_description }
             return
             
         # If we already have this sample, and the new one's created_at time is greater than or equal to the
@@ -297,22 +609,34 @@ class LabGuruBioCollections:
         # time in the tracker, and put the old one's id on the deletion list.
         prev_id = self._sample_tracker[short_type][sample_name]['id']
         prev_create_time = self._sample_tracker[short_type][sample_name]['created_at']
+        prev_description = self._sample_tracker[short_type][sample_name]['description']
         
         if curr_create_time < prev_create_time:
             logging.debug(f"For {short_type}, {sample_name}, replacing previous sample {prev_id} with {curr_id}.")
             # Current sample is older. Put it in the tracker, and mark the one that was there for deletion.
             self._sample_tracker[short_type][sample_name]['id'] = curr_id
             self._sample_tracker[short_type][sample_name]['created_at'] = curr_create_time
-            self._dups_to_delete[short_type].append(prev_id)
+            self._sample_tracker[short_type][sample_name]['description'] = curr_description
+            self._dups_to_delete[short_type].append((prev_id, sample_name, prev_create_time, prev_description))
         
         else:
             logging.debug(f"For {short_type}, {sample_name}, rejecting newer sample {curr_id} for {prev_id}.")
             # Current sample is not older. Leave the sample in the tracker unchanged, and mark the
             # current one for deletion.
-            self._dups_to_delete[short_type].append(curr_id)
+            self._dups_to_delete[short_type].append((curr_id, sample_name, curr_create_time, curr_description))
             
+
+
+def get_short_type(sample_type):
+
+    """ Get the lowercase first word from the sample type with no hyphens, which names its collection. """
+
+    short_type = sample_type.replace('-', ' ').split(' ')[0].lower()
+    return short_type
+
             
 if __name__ == "__main__":
     lgbc = LabGuruBioCollections()
+    lgbc.load()
 	
 		
@@ -0,0 +1,272 @@
+#!/usr/env/bin python
+
+# Run the Climb to LabGuru export for several labs in one process. Each lab is described by a
+# profile, which overrides parts of config.cfg: its workgroups, LabGuru collections, recipients,
+# and so on. The labs share one HTTP connection pool and rate limit, and one lab failing does not
+# stop the others.
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import datetime
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import ClimbToLabGuruExporter
+import HttpClient
+
+
+# Sections a profile replaces whole, rather than merging its keys into those of config.cfg, so a lab
+# only exports to the collections it lists. The base url is kept unless the profile gives its own.
+REPLACED_SECTIONS = ["labguru_api_sample_urls", "labguru_sample_descriptions"]
+
+# The (section, option) of each path a tenant must not share with another. Profiles that don't set
+# one get the base config's path, moved into a directory named for the tenant. The workgroup cache
+# is relative to the log directory, and holds the workgroups of the tenant's Climb user.
+TENANT_PATHS = [("index", "name_index_file"), ("journal", "journal_dir"), ("labguru_index", "db_path"),
+    ("logging", "sentinal_file"), ("climb", "workgroup_cache_file")]
+
+
+class MultiTenantRunner:
+
+    """ Export samples from Climb to LabGuru for several tenants, each with its own config profile. """
+
+    def __init__(self, runner_config_file):
+
+        """
+
+        Read the runner's config file, and each tenant's profile.
+
+        Parameters:
+
+            runner_config_file (str): The runner's config file. Profile paths in it are relative to its directory.
+
+        """
+
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        self.base_config_file = os.path.join(src_dir, "config.cfg")
+
+        runner_config = configparser.ConfigParser()
+        if not runner_config.read(runner_config_file):
+            sys.exit(f"Cannot read runner config file {runner_config_file}")
+        runner_dir = os.path.dirname(os.path.abspath(runner_config_file))
+
+        self.max_parallel_tenants = int(runner_config["runner"]["max_parallel_tenants"])
+        self.concurrency = int(runner_config["runner"]["concurrency"])
+        self.report_dir = runner_config["runner"]["report_dir"]
+        self.requests_per_second = float(runner_config["runner"]["requests_per_second"]) or None
+        self.pool_size = int(runner_config["runner"]["pool_size"])
+
+        # Map each tenant's name to its full config, the base config file overridden by its profile.
+        self.tenants = {}
+        for profile in [x.strip() for x in runner_config["runner"]["profiles"].split(',') if x.strip()]:
+            name, config = self.__read_profile(os.path.join(runner_dir, profile))
+            if name in self.tenants:
+                sys.exit(f"More than one tenant profile is named {name}")
+            self.tenants[name] = config
+        if not self.tenants:
+            sys.exit(f"No tenant profiles listed in {runner_config_file}")
+        self.__check_tenant_paths()
+
+        # Climb's current workgroup is kept per user on the server, so tenants that log in to Climb as
+        # the same user must take turns reading from it.
+        self._climb_locks = {}
+        for config in self.tenants.values():
+            self._climb_locks.setdefault((config["climb"]["get_token_url"], config["climb"]["username"]), threading.Lock())
+
+
+    def run(self):
+
+        """
+
+        Run every tenant's export, and write a report of the results.
+
+        Returns:
+
+            results (dict): Maps each tenant's name to a dict describing its run. See write_report.
+
+        """
+
+        HttpClient.configure(requests_per_second=self.requests_per_second, pool_size=self.pool_size)
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_tenants) as executor:
+            futures = { name : executor.submit(self.run_tenant, name) for name in self.tenants }
+            results = { name : future.result() for name, future in futures.items() }
+
+        self.write_report(results)
+        return results
+
+
+    def run_tenant(self, name):
+
+        """
+
+        Run one tenant's export. Any error is caught and reported, so the other tenants carry on.
+
+        Parameters:
+
+            name (str): The tenant's name.
+
+        Returns:
+
+            result (dict): The keys are status ("ok" or "failed"), samples_found, samples_added,
+                seconds, and error.
+
+        """
+
+        # Log lines from this thread, and the threads it starts, are labelled with the tenant's name.
+        threading.current_thread().name = name
+        config = self.tenants[name]
+        result = { "status" : "failed", "samples_found" : None, "samples_added" : None, "seconds" : 0.0, "error" : "" }
+        start_time = time.perf_counter()
+        exporter = None
+
+        try:
+            logging.info(f"Starting export for tenant {name}.")
+            exporter = ClimbToLabGuruExporter.ClimbToLabGuruExporter(concurrency=self.concurrency, config=config,
+                setup_logger=False)
+
+            with self._climb_locks[(config["climb"]["get_token_url"], config["climb"]["username"])]:
+                samples = exporter.get_all_samples_from_climb()
+            if samples is None:
+                raise RuntimeError("Could not get samples from Climb")
+            result["samples_found"] = len(samples)
+
+            result["samples_added"] = exporter.add_all_samples_to_labguru(samples)
+            if result["samples_added"] is None:
+                raise RuntimeError("Could not add samples to LabGuru")
+
+            exporter.send_report()
+            exporter.write_sentinal_file()
+            result["status"] = "ok"
+        except (Exception, SystemExit) as e:
+            # The clients call sys.exit on some errors. That should only end this tenant's run.
+            logging.error(f"Export for tenant {name} failed: {type(e).__name__}: {str(e)}")
+            result["error"] = f"{type(e).__name__}: {str(e)}"
+        finally:
+            # The process outlives this run, so don't leave the journal's last records unsynced until it exits.
+            if exporter is not None:
+                exporter.close_journal()
+
+        result["seconds"] = time.perf_counter() - start_time
+        logging.info(f"Finished export for tenant {name}, status {result['status']}.")
+        return result
+
+
+    def setup_logger(self, level):
+
+        """ Log to a new file in the report directory, labelling each line with its tenant. """
+
+        if not os.path.isdir(self.report_dir):
+            os.makedirs(self.report_dir, exist_ok=True)
+        log_file = "multi_tenant_export_log_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".txt"
+        log_path = os.path.join(self.report_dir, log_file)
+        print(f"Log file located at {log_path}")
+        logging.basicConfig(filename=log_path, filemode='w', level=logging.getLevelName(level),
+            format='%(asctime)s %(threadName)s %(levelname)s: %(message)s')
+
+
+    def write_report(self, results):
+
+        """
+
+        Write a tab-delimited report of each tenant's run to the report directory.
+
+        Returns:
+
+            report_path (str): The full path of the report.
+
+        """
+
+        report_file = "multi_tenant_export_report_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".txt"
+        report_path = os.path.join(self.report_dir, report_file)
+        if not os.path.isdir(self.report_dir):
+            os.makedirs(self.report_dir, exist_ok=True)
+
+        with open(report_path, 'w') as f:
+            f.write("tenant\tstatus\tsamples_found\tsamples_added\tseconds\terror\n")
+            for name, result in results.items():
+                f.write(f"{name}\t{result['status']}\t{result['samples_found']}\t{result['samples_added']}\t"
+                    f"{result['seconds']:.1f}\t{result['error']}\n")
+
+        logging.info(f"Wrote multi-tenant report to {report_path}")
+        return report_path
+
+
+    def __check_tenant_paths(self):
+
+        """ Exit if two tenants would share an index, journal, database, sentinal file or workgroup cache. """
+
+        # A shared index or database would be rebuilt by one tenant while another reads it, and a
+        # shared sentinal file would mark every tenant done when one is.
+        owners = {}
+        for name, config in self.tenants.items():
+            for section, option in TENANT_PATHS:
+                path = config[section][option]
+                if option == "workgroup_cache_file":
+                    path = os.path.join(config["logging"]["log_dir"], path)
+                path = os.path.normcase(os.path.abspath(path))
+                if path in owners:
+                    other_name, other_option = owners[path]
+                    sys.exit(f"Tenants {other_name} ({other_option}) and {name} ({option}) both use {path}. "
+                        "Give each tenant its own path.")
+                owners[path] = (name, option)
+
+
+    def __read_profile(self, profile_path):
+
+        """
+
+        Read a tenant's profile over the base config file.
+
+        Parameters:
+
+            profile_path (str): The full path of the profile.
+
+        Returns:
+
+            name (str): The tenant's name, from its profile or else the profile's file name.
+
+            config (ConfigParser): The tenant's full config.
+
+        """
+
+        profile_config = configparser.ConfigParser()
+        if not profile_config.read(profile_path):
+            sys.exit(f"Cannot read tenant profile {profile_path}")
+        name = profile_config.get("tenant", "name", fallback=os.path.splitext(os.path.basename(profile_path))[0])
+
+        config = configparser.ConfigParser()
+        config.read(self.base_config_file)
+        for section in REPLACED_SECTIONS:
+            if profile_config.has_section(section):
+                for option in list(config[section]):
+                    if option != "base_url":
+                        config.remove_option(section, option)
+
+        # Paths the profile doesn't set go in a directory of the tenant's own, next to the base path.
+        tenant_dir = re.sub(r'[^\w\-]+', '_', name)
+        for section, option in TENANT_PATHS:
+            base_path = config[section][option]
+            config[section][option] = os.path.join(os.path.dirname(base_path), tenant_dir, os.path.basename(base_path))
+
+        config.read(profile_path)
+        return name, config
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the Climb to LabGuru export for several tenants.")
+    parser.add_argument("runner_config", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        "tenants.cfg"), help="The runner's config file, listing the tenant profiles.")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARN, or ERROR.")
+    args = parser.parse_args()
+
+    runner = MultiTenantRunner(args.runner_config)
+    runner.setup_logger(args.log_level)
+    results = runner.run()
+    sys.exit(0 if all(result["status"] == "ok" for result in results.values()) else 1)
@@ -0,0 +1,257 @@
+#!/usr/env/bin python
+
+# An append-only journal of every sample created in or deleted from LabGuru. The name index
+# can be rebuilt by replaying it, and deletes from a bad run can be undone.
+
+import argparse
+import atexit
+import configparser
+import datetime
+import glob
+import json
+import logging
+import os
+import sys
+
+import SampleNameIndex
+
+
+class MutationJournal:
+
+    """
+
+    Record LabGuru creates and deletes as NDJSON lines in numbered segment files.
+
+    Each line is a dict with the keys "op" ("create", "delete" or "checkpoint"), "ts", and for
+    creates and deletes "short_type", "name", "id", "description", and "auto_name" if LabGuru gave one.
+    A checkpoint marks the point at which the name index was last rebuilt from a full snapshot.
+
+    """
+
+    def __init__(self, journal_dir, fsync_every=100, max_segment_bytes=16 * 1024 * 1024):
+
+        """
+
+        Initialize data members. The journal is opened on the first write.
+
+        Parameters:
+
+            journal_dir (str): The directory holding the segment files.
+
+            fsync_every (int): Records are flushed to disk after this many writes.
+
+            max_segment_bytes (int): A new segment is started once the current one reaches this size.
+
+        """
+
+        self.journal_dir = journal_dir
+        self.fsync_every = fsync_every
+        self.max_segment_bytes = max_segment_bytes
+
+        self._segment = None
+        self._unsynced = 0
+
+
+    def checkpoint(self, index_path):
+
+        """ Mark that the name index at index_path was just rebuilt from a full LabGuru snapshot. """
+
+        # Start a new segment, so replay never has to read anything before the last checkpoint.
+        self.__rotate()
+        self.__write({ "op" : "checkpoint", "index" : index_path })
+        self.sync()
+
+
+    def close(self):
+
+        """ Flush any outstanding records and close the current segment. The next write reopens it. """
+
+        if self._segment:
+            self.sync()
+            self._segment.close()
+            self._segment = None
+            atexit.unregister(self.close)
+
+
+    def iter_records(self, since=None):
+
+        """
+
+        Iterate over the records in the journal, oldest first.
+
+        Parameters:
+
+            since (str): If given, only records with an ISO timestamp at or after this one are returned.
+
+        Returns:
+
+            A generator of record dicts.
+
+        """
+
+        for segment_path in self.__segment_paths():
+            with open(segment_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash can leave a partial last line. Nothing after it was written.
+                        logging.warning(f"Skipping unreadable journal line in {segment_path}")
+                        continue
+                    if since is None or record["ts"] >= since:
+                        yield record
+
+
+    def record_create(self, short_type, name, sample_id, auto_name=None, description=None):
+
+        """ Record that a sample was added to LabGuru. """
+
+        self.__write({ "op" : "create", "short_type" : short_type, "name" : name, "id" : sample_id,
+            "auto_name" : auto_name, "description" : description })
+
+
+    def record_delete(self, short_type, name, sample_id, description=None):
+
+        """ Record that a sample was deleted from LabGuru, with its description so it can be restored as it was. """
+
+        self.__write({ "op" : "delete", "short_type" : short_type, "name" : name, "id" : sample_id,
+            "description" : description })
+
+
+    def replay(self, name_index):
+
+        """
+
+        Bring the name index up to date by applying every create and delete since the last checkpoint.
+
+        Parameters:
+
+            name_index (SampleNameIndex): The index written at the last checkpoint, rewritten in place.
+
+        Returns:
+
+            num_applied (int): The number of records applied.
+
+        """
+
+        records = []
+        for record in self.iter_records():
+            if record["op"] == "checkpoint":
+                records = []
+            else:
+                records.append(record)
+
+        samples = { (short_type, name) : sample_id for short_type, name, sample_id in name_index.iter_entries() }
+        for record in records:
+            key = (record["short_type"], record["name"])
+            if record["op"] == "create":
+                samples[key] = record["id"]
+            elif str(samples.get(key)) == str(record["id"]):
+                # Deleting a duplicate leaves the kept sample in place, so only drop the name if this was it.
+                del samples[key]
+
+        name_index.build((short_type, name, sample_id) for (short_type, name), sample_id in samples.items())
+        logging.info(f"Replayed {len(records)} journal records into {name_index.index_path}")
+        return len(records)
+
+
+    def sync(self):
+
+        """ Flush written records through to disk. """
+
+        if self._segment:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._unsynced = 0
+
+
+    def __open_segment(self, segment_num):
+
+        """ Open the numbered segment for appending. """
+
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir, exist_ok=True)
+        segment_path = os.path.join(self.journal_dir, "journal_" + str(segment_num).zfill(6) + ".ndjson")
+        self._segment = open(segment_path, 'a', encoding='utf-8')
+        # Runs should close the journal when done. This is only a safety net for those that don't.
+        atexit.register(self.close)
+
+
+    def __rotate(self):
+
+        """ Close the current segment, if any, and open the next one. """
+
+        paths = self.__segment_paths()
+        last_num = int(os.path.basename(paths[-1])[len("journal_"):-len(".ndjson")]) if paths else 0
+        self.close()
+        self.__open_segment(last_num + 1)
+
+
+    def __segment_paths(self):
+
+        """ Get the full paths of all segments, in order. """
+
+        return sorted(glob.glob(os.path.join(self.journal_dir, "journal_*.ndjson")))
+
+
+    def __write(self, record):
+
+        """ Append one record, syncing and rotating as needed. """
+
+        if self._segment is None:
+            paths = self.__segment_paths()
+            if paths:
+                self.__open_segment(int(os.path.basename(paths[-1])[len("journal_"):-len(".ndjson")]))
+            else:
+                self.__open_segment(1)
+        elif self._segment.tell() >= self.max_segment_bytes:
+            self.__rotate()
+
+        record["ts"] = datetime.datetime.now().isoformat()
+        self._segment.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+
+def from_config(config):
+
+    """ Make a journal from the [journal] section of the config file, or None if it is disabled. """
+
+    if not config.getboolean("journal", "enabled", fallback=False):
+        return None
+    return MutationJournal(config["journal"]["journal_dir"], fsync_every=int(config["journal"]["fsync_every"]),
+        max_segment_bytes=int(float(config["journal"]["max_segment_mb"]) * 1024 * 1024))
+
+
+if __name__ == "__main__":
+
+    # Run by itself, this code rebuilds the name index from the journal, or undoes deletes.
+
+    parser = argparse.ArgumentParser(description="Replay the LabGuru mutation journal.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Rebuild the name index from the last checkpoint and the journal.")
+    undo_parser = subparsers.add_parser("undo", help="Re-create every sample deleted since a time.")
+    undo_parser.add_argument("since", help="An ISO timestamp, e.g. 2025-02-01T15:00:00")
+    args = parser.parse_args()
+
+    # Load config file, which is in the same directory as the source code.
+    config = configparser.ConfigParser()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    config.read(os.path.join(src_dir, "config.cfg"))
+
+    journal = from_config(config)
+    if journal is None:
+        sys.exit("The journal is not enabled in the config file.")
+
+    if args.command == "rebuild":
+        journal.replay(SampleNameIndex.SampleNameIndex(config["index"]["name_index_file"]))
+    else:
+        import LabGuruBioCollections
+        # Don't delete duplicates on the way in, or the samples being restored would be deleted again.
+        lgbc = LabGuruBioCollections.LabGuruBioCollections(delete_duplicates=False)
+        deletes = [record for record in journal.iter_records(args.since) if record["op"] == "delete"]
+        # Records written before descriptions were journaled fall back to the collection's default.
+        num_restored = sum(1 for record in deletes
+            if lgbc.restore_sample(record["short_type"], record["name"], record.get("description")))
+        print(f"Restored {num_restored} of {len(deletes)} deleted samples.")
@@ -0,0 +1,131 @@
+#!/usr/env/bin python
+
+# Profile each phase of an exporter run, writing pstats and collapsed-stack files
+# to the log directory and a summary of the hotspots to the run log.
+
+from collections import Counter
+import configparser
+import contextlib
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+class RunProfiler:
+
+    """
+
+    Profile named phases of a run with cProfile, and optionally a sampling profiler.
+
+    The sampler records the profiled thread's stack at a fixed interval. Its output is in the
+    collapsed-stack format ("frame;frame;frame count" per line) read by flame graph tools.
+
+    """
+
+    def __init__(self, enabled=None):
+
+        """
+
+        Read config file, initialize data members.
+
+        Parameters:
+
+            enabled (bool): Overrides the config file's setting of whether to profile, if given.
+
+        """
+
+        # Load config file, which is in the same directory as the source code.
+        config = configparser.ConfigParser()
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        config.read(os.path.join(src_dir, "config.cfg"))
+
+        self.enabled = config.getboolean("profiling", "enabled", fallback=False) if enabled is None else enabled
+        self.sampling = config.getboolean("profiling", "sampling", fallback=True)
+        self.sample_interval = float(config["profiling"]["sample_interval_ms"]) / 1000
+        self.top_n = int(config["profiling"]["top_n"])
+        self.log_dir = config["logging"]["log_dir"]
+
+        # All files from one run share a timestamp, so they sort together.
+        self.run_name = "climb_to_labguru_profile_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+    @contextlib.contextmanager
+    def phase(self, phase_name):
+
+        """
+
+        Profile the code run inside this context, if profiling is enabled.
+
+        Parameters:
+
+            phase_name (str): Names the output files, and the phase in the log.
+
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = None
+        if self.sampling:
+            sampler = threading.Thread(target=self.__sample, args=(threading.get_ident(), phase_name, stacks, stop),
+                daemon=True)
+            sampler.start()
+
+        profile = cProfile.Profile()
+        start_time = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start_time
+            if sampler:
+                stop.set()
+                sampler.join()
+            self.__write_results(phase_name, elapsed, profile, stacks)
+
+
+    def __sample(self, thread_id, phase_name, stacks, stop):
+
+        """ Record the profiled thread's stack every sample interval until told to stop. """
+
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.append(phase_name)
+            stacks[';'.join(reversed(frames))] += 1
+
+
+    def __write_results(self, phase_name, elapsed, profile, stacks):
+
+        """ Write the phase's pstats and collapsed stacks, and log its hotspots. """
+
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            base_path = os.path.join(self.log_dir, self.run_name + "_" + phase_name.replace(' ', '_'))
+
+            profile.dump_stats(base_path + ".pstats")
+            if stacks:
+                with open(base_path + ".collapsed", 'w') as f:
+                    for stack, count in stacks.items():
+                        f.write(f"{stack} {count}\n")
+
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(self.top_n)
+            logging.info(f"Profile of phase {phase_name}, {elapsed:.2f} seconds, written to {base_path}.*\n{summary.getvalue()}")
+        except Exception as e:
+            # Profiling must never fail the run it is measuring.
+            logging.error(f"Could not write profile for phase {phase_name}, received exception {str(e)}")
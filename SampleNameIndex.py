@@ -0,0 +1,217 @@
+#!/usr/env/bin python
+
+# A persistent, sorted index of the (short type, name) of every sample already in LabGuru,
+# used to filter known samples out in bulk before they reach the per-sample checks.
+
+import logging
+import mmap
+import os
+
+
+class SampleNameIndex:
+
+    """
+
+    A sorted file of samples already in LabGuru, searched through a memory map.
+
+    Each line of the file is "short_type<TAB>name<TAB>id", encoded as utf-8, and the lines
+    are sorted by their bytes up to the last tab, so the file can be merged against or binary
+    searched without loading it.
+
+    """
+
+    def __init__(self, index_path):
+
+        """
+
+        Initialize data members.
+
+        Parameters:
+
+            index_path (str): The full path of the index file. It need not exist yet.
+
+        """
+
+        self.index_path = index_path
+
+
+    def build(self, samples, presorted=False):
+
+        """
+
+        Rewrite the index from a snapshot of LabGuru.
+
+        Parameters:
+
+            samples (iterable): (short_type, name, id, ...) tuples, such as those from
+                LabGuruBioCollections.iter_tracked_samples.
+
+            presorted (bool): Whether the samples are already ordered by short type and then name.
+                If so, they are streamed to the file rather than collected and sorted in memory.
+
+        Returns:
+
+            num_indexed (int): The number of samples written to the index.
+
+        """
+
+        lines = self.__iter_lines(samples)
+        if not presorted:
+            # Sort on the key alone. The bytes after it would otherwise decide the order of keys where one
+            # is a prefix of the other, since a tab sorts after names' bytes 0x01-0x08.
+            lines = sorted(lines, key=self.__line_key)
+
+        # Write to a temporary file and then replace, so a failed build never leaves a partial index.
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        num_indexed = 0
+        prev_key = None
+        try:
+            with open(tmp_path, 'wb') as f:
+                for line in lines:
+                    key = self.__line_key(line)
+                    if prev_key is not None and key < prev_key:
+                        raise ValueError(f"Samples for the index are out of order at {key!r}")
+                    prev_key = key
+                    f.write(line)
+                    num_indexed += 1
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, self.index_path)
+
+        logging.info(f"Indexed {num_indexed} LabGuru samples in {self.index_path}")
+        return num_indexed
+
+
+    def contains(self, short_type, name):
+
+        """ Find whether a sample of this short type and name is in the index. """
+
+        return self.lookup(short_type, name) is not None
+
+
+    def filter_unknown(self, samples, get_short_type):
+
+        """
+
+        Remove the samples already in the index, with one sorted merge against the index file.
+
+        Parameters:
+
+            samples (list): A list of Climb sample dicts, each with a "type" and a "name".
+
+            get_short_type (function): Maps a Climb sample type to its short type.
+
+        Returns:
+
+            unknown (list): The samples not in the index, in their original order.
+
+        """
+
+        keys = [self.get_key(get_short_type(sample["type"]), sample["name"]) for sample in samples]
+        order = sorted((i for i, key in enumerate(keys) if key is not None), key=lambda i: keys[i])
+        known = [False] * len(samples)
+
+        # Walk the sorted sample keys and the sorted index lines together.
+        lines = self.__iter_keys()
+        line_key = next(lines, None)
+        for i in order:
+            while line_key is not None and line_key < keys[i]:
+                line_key = next(lines, None)
+            if line_key is None:
+                break
+            known[i] = line_key == keys[i]
+
+        unknown = [sample for sample, is_known in zip(samples, known) if not is_known]
+        logging.info(f"Prefilter found {len(samples) - len(unknown)} of {len(samples)} samples already in LabGuru.")
+        return unknown
+
+
+    def get_key(self, short_type, name):
+
+        """ Get the sort key for a sample, or None if its name contains a tab or newline. """
+
+        if '\t' in name or '\n' in name:
+            return None
+        return (short_type + '\t' + name).encode('utf-8')
+
+
+    def iter_entries(self):
+
+        """ Iterate over the (short_type, name, id) of every sample in the index, in sorted order. """
+
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                short_type, name, sample_id = line.rstrip(b'\n').decode('utf-8').split('\t')
+                yield short_type, name, sample_id
+
+
+    def lookup(self, short_type, name):
+
+        """
+
+        Binary search the index for a sample.
+
+        Returns:
+
+            sample_id (str): The sample's LabGuru id, or None if it isn't in the index.
+
+        """
+
+        key = self.get_key(short_type, name)
+        if key is None or not os.path.isfile(self.index_path) or os.path.getsize(self.index_path) == 0:
+            return None
+
+        with open(self.index_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lo, hi = 0, len(mm)
+            while lo < hi:
+                # Find the line containing the midpoint, and compare its key.
+                mid = (lo + hi) // 2
+                start = mm.rfind(b'\n', 0, mid) + 1
+                end = mm.find(b'\n', start)
+                sep = mm.rfind(b'\t', start, end)
+                line_key = mm[start:sep]
+                if line_key < key:
+                    lo = end + 1
+                elif line_key > key:
+                    hi = start
+                else:
+                    return mm[sep + 1:end].decode('utf-8')
+        return None
+
+
+    def __iter_lines(self, samples):
+
+        """ Iterate over the index file lines for the samples, skipping those that can't be indexed. """
+
+        for sample in samples:
+            short_type, name, sample_id = sample[0], sample[1], sample[2]
+            key = self.get_key(short_type, name)
+            if key is None:
+                # These samples won't be prefiltered, and will still go through the full per-sample check.
+                logging.debug(f"Not indexing sample {name} of type {short_type}, its name can't be stored in the index.")
+                continue
+            yield key + b'\t' + str(sample_id).encode('utf-8') + b'\n'
+
+
+    def __iter_keys(self):
+
+        """ Iterate over the keys in the index file, in sorted order. """
+
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                yield self.__line_key(line)
+
+
+    def __line_key(self, line):
+
+        """ Get the key of a line of the index file, everything before its last tab. """
+
+        return line[:line.rindex(b'\t')]
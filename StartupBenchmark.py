@@ -0,0 +1,86 @@
+#!/usr/env/bin python
+
+# Measure how long the exporter takes to start, before anything touches the network.
+# Exits non-zero if startup is over budget, or if the network clients were loaded early.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_command(args, num_runs):
+
+    """
+
+    Time a command run as a fresh process, as the scheduled job runs it.
+
+    Parameters:
+
+        args (list): The arguments to pass to ClimbToLabGuruExporter.py.
+
+        num_runs (int): The number of times to run the command.
+
+    Returns:
+
+        timings (list): The wall clock time of each run, in seconds.
+
+    """
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(src_dir, "ClimbToLabGuruExporter.py")] + args
+    timings = []
+    for i in range(num_runs):
+        start_time = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def time_construction():
+
+    """
+
+    Time importing and constructing the exporter in this process, and check no client was loaded.
+
+    Returns:
+
+        elapsed (float): The time taken, in seconds.
+
+        early_modules (list): Any network modules that were imported by construction.
+
+    """
+
+    start_time = time.perf_counter()
+    import ClimbToLabGuruExporter
+    # Don't leave a log file in the production log directory for every benchmark run.
+    ClimbToLabGuruExporter.ClimbToLabGuruExporter(setup_logger=False)
+    elapsed = time.perf_counter() - start_time
+
+    early_modules = [name for name in ("requests", "smtplib", "ClimbSamples", "Emailer", "LabGuruBioCollections")
+        if name in sys.modules]
+    return elapsed, early_modules
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the exporter's startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="The number of times each command is run.")
+    parser.add_argument("--budget", type=float, default=1.0, help="The most seconds a quick command may take.")
+    args = parser.parse_args()
+
+    elapsed, early_modules = time_construction()
+    print(f"import and construct: {elapsed:.3f}s")
+    if early_modules:
+        print(f"Loaded before first use: {', '.join(early_modules)}")
+
+    over_budget = elapsed > args.budget or bool(early_modules)
+    for command_args in (["--help"], ["--count"]):
+        timings = time_command(command_args, args.runs)
+        median = statistics.median(timings)
+        print(f"{' '.join(command_args)}: median {median:.3f}s, min {min(timings):.3f}s over {args.runs} runs")
+        over_budget = over_budget or median > args.budget
+
+    sys.exit(1 if over_budget else 0)
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+import SampleNameIndex
+
+
+# Names are drawn from short strings over an alphabet with control bytes that sort before a tab,
+# so many names are prefixes of others.
+ALPHABET = ["a", "b", "\x01", "\x05", "\x08", " ", "-", "é"]
+SHORT_TYPES = ["kidney", "liver", "tail"]
+
+
+def random_samples(rng, count):
+    samples = set()
+    while len(samples) < count:
+        name = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 4)))
+        samples.add((rng.choice(SHORT_TYPES), name))
+    return samples
+
+
+def test_lookup_and_filter_match_set_membership(tmp_path):
+    rng = random.Random(0)
+    for trial in range(20):
+        indexed = random_samples(rng, 200)
+        candidates = list(random_samples(rng, 200) | set(rng.sample(sorted(indexed), 50)))
+        rng.shuffle(candidates)
+
+        index = SampleNameIndex.SampleNameIndex(str(tmp_path / f"names_{trial}.idx"))
+        samples = [(short_type, name, i) for i, (short_type, name) in enumerate(sorted(indexed))]
+        rng.shuffle(samples)
+        assert index.build(samples) == len(indexed)
+
+        for short_type, name in candidates:
+            assert index.contains(short_type, name) == ((short_type, name) in indexed)
+
+        climb_samples = [{ "type" : short_type, "name" : name } for short_type, name in candidates]
+        unknown = index.filter_unknown(climb_samples, lambda sample_type: sample_type)
+        assert unknown == [sample for sample in climb_samples if (sample["type"], sample["name"]) not in indexed]
+
+
+def test_lookup_returns_id(tmp_path):
+    index = SampleNameIndex.SampleNameIndex(str(tmp_path / "names.idx"))
+    index.build([("liver", "a", 1), ("liver", "a\x01", 2), ("liver", "ab", 3)])
+    assert index.lookup("liver", "a") == "1"
+    assert index.lookup("liver", "a\x01") == "2"
+    assert index.lookup("liver", "ab") == "3"
+    assert index.lookup("liver", "b") is None
+
+
+def test_names_with_tabs_are_not_indexed(tmp_path):
+    index = SampleNameIndex.SampleNameIndex(str(tmp_path / "names.idx"))
+    assert index.build([("liver", "a\tb", 1), ("liver", "c", 2)]) == 1
+    assert not index.contains("liver", "a\tb")
+    assert index.contains("liver", "c")
+
+
+def test_presorted_build_matches_sorted_build(tmp_path):
+    rng = random.Random(1)
+    samples = [(short_type, name, i) for i, (short_type, name) in enumerate(sorted(random_samples(rng, 300)))]
+    streamed = SampleNameIndex.SampleNameIndex(str(tmp_path / "streamed.idx"))
+    assert streamed.build(iter(samples), presorted=True) == len(samples)
+
+    rng.shuffle(samples)
+    collected = SampleNameIndex.SampleNameIndex(str(tmp_path / "collected.idx"))
+    collected.build(samples)
+    assert (tmp_path / "streamed.idx").read_bytes() == (tmp_path / "collected.idx").read_bytes()
+
+
+def test_presorted_build_rejects_unsorted_samples(tmp_path):
+    index = SampleNameIndex.SampleNameIndex(str(tmp_path / "names.idx"))
+    index.build([("liver", "a", 1)])
+    with pytest.raises(ValueError):
+        index.build([("liver", "b", 1), ("liver", "a", 2)], presorted=True)
+    assert index.contains("liver", "a")
+    assert not (tmp_path / "names.idx.tmp").exists()
@@ -2,12 +2,18 @@
 
 # lower level utilities to interact with Climb
 
+from concurrent.futures import ThreadPoolExecutor
 from logging import NullHandler
 import requests
 import sys
 import json
 import datetime
 import logging
+import os
+import tempfile
+import time
+
+import HttpClient
 
 
 
@@ -17,7 +23,7 @@ def getToken(tokenUrl, username, password):
     
     try:
         """ Given a username and password, return an access token good for an hour."""
-        response = requests.get(tokenUrl,auth=(username,password))
+        response = HttpClient.get_session().get(tokenUrl,auth=(username,password))
         myContent = response.json()
         global myToken
         myToken = myContent['access_token']
@@ -77,7 +83,7 @@ def getSamples(endpointUrl, myToken, **kwargs):
 
     try:
         call_header = {'Authorization' : 'Bearer ' + myToken}
-        wgResponse = requests.get(endpointUrl+'samples', headers=call_header, params=kwargs)
+        wgResponse = HttpClient.get_session().get(endpointUrl+'samples', headers=call_header, params=kwargs)
         wgJson = wgResponse.json()
         # If caller passed the all_response argument, give the whole thing
         if kwargs.get("all_response"):
@@ -105,7 +111,7 @@ def getSamples(endpointUrl, myToken, **kwargs):
 def getWorkgroups(endpointUrl, myToken):
     try:
         call_header = {'Authorization' : 'Bearer ' + myToken}
-        wgResponse = requests.get(endpointUrl+'workgroups', headers=call_header)
+        wgResponse = HttpClient.get_session().get(endpointUrl+'workgroups', headers=call_header)
         wgJson = wgResponse.json()
         # Check for number of items
         total_item_count = wgJson.get('totalItemCount')
@@ -128,19 +134,119 @@ def getWorkgroups(endpointUrl, myToken):
 
         
 # Workgroup name example: 'KOMP AI Training'
-def setWorkgroup(endpointUrl, myToken, workgroupName):
-    dict_list = getWorkgroups(endpointUrl, myToken)
-    success = False
+def setWorkgroup(endpointUrl, myToken, workgroupName, cacheFile=None, cacheTtlSeconds=86400):
+
+    """
+
+    Switch the current workgroup in Climb.
+
+    Parameters:
+
+        endpointUrl (str): Climb's endpoint URL.
+
+        myToken (str): The token returned by a call to getToken
+
+        workgroupName (str): The name of the workgroup to switch to.
+
+        cacheFile (str): Optional file caching the workgroup name to key lookup between runs.
 
-    for x in dict_list:
-        if x['workgroupName'] == workgroupName:
-            call_header = {'Authorization' : 'Bearer ' + myToken}
-            status_code = requests.put(endpointUrl+'workgroups/'+str(x['workgroupKey']), headers=call_header)
-            print(status_code)
-            success = True
+        cacheTtlSeconds (int): How long the cached lookup is used before it is fetched again.
+
+    Returns:
+
+        success (bool): True if the workgroup was switched.
+
+    """
+
+    workgroup_keys = _readWorkgroupCache(endpointUrl, cacheFile, cacheTtlSeconds)
+    from_cache = workgroup_keys is not None
+    if not from_cache:
+        workgroup_keys = getWorkgroupKeys(endpointUrl, myToken, cacheFile)
+
+    success = _putWorkgroup(endpointUrl, myToken, workgroup_keys.get(workgroupName))
+
+    # The cache may be out of date, e.g. if the workgroup was renamed. Refresh it once and try again.
+    if not success and from_cache:
+        logging.info(f"Could not switch to workgroup {workgroupName} from cached key, refreshing workgroups.")
+        workgroup_keys = getWorkgroupKeys(endpointUrl, myToken, cacheFile)
+        success = _putWorkgroup(endpointUrl, myToken, workgroup_keys.get(workgroupName))
 
     # If successful, remember to get a new access token!
-    return success        
+    return success
+
+
+def getWorkgroupKeys(endpointUrl, myToken, cacheFile=None):
+
+    """
+
+    Get a lookup of each workgroup's name to its workgroupKey from Climb.
+
+    Parameters:
+
+        endpointUrl (str): Climb's endpoint URL.
+
+        myToken (str): The token returned by a call to getToken
+
+        cacheFile (str): If given, the lookup is also written here for later runs.
+
+    Returns:
+
+        workgroup_keys (dict): Maps workgroupName to workgroupKey. If names repeat, the first is kept.
+
+    """
+
+    workgroup_keys = {}
+    for x in getWorkgroups(endpointUrl, myToken):
+        workgroup_keys.setdefault(x['workgroupName'], x['workgroupKey'])
+
+    if cacheFile:
+        # Write to a temporary file and then replace, so a concurrent reader never sees a partial cache.
+        tmpPath = None
+        try:
+            cache = { "endpointUrl" : endpointUrl, "fetched_at" : time.time(), "workgroups" : workgroup_keys }
+            cacheDir = os.path.dirname(cacheFile)
+            if cacheDir and not os.path.isdir(cacheDir):
+                os.makedirs(cacheDir, exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=cacheDir or None, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmpPath, cacheFile)
+        except OSError as e:
+            logging.warning(f"Could not write workgroup cache {cacheFile}: {str(e)}")
+            if tmpPath and os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    return workgroup_keys
+
+
+def _putWorkgroup(endpointUrl, myToken, workgroupKey):
+
+    """ Make the given workgroup current. Returns True if Climb accepted it. """
+
+    if workgroupKey is None:
+        return False
+    call_header = {'Authorization' : 'Bearer ' + myToken}
+    response = HttpClient.get_session().put(endpointUrl+'workgroups/'+str(workgroupKey), headers=call_header)
+    logging.debug(f"Setting workgroup {workgroupKey} returned {response.status_code}")
+    return response.ok
+
+
+def _readWorkgroupCache(endpointUrl, cacheFile, cacheTtlSeconds):
+
+    """ Get the cached workgroup lookup, or None if there isn't a current one for this endpoint. """
+
+    if not cacheFile or not os.path.isfile(cacheFile):
+        return None
+    try:
+        with open(cacheFile) as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read workgroup cache {cacheFile}: {str(e)}")
+        return None
+
+    if cache.get("endpointUrl") != endpointUrl or time.time() - cache.get("fetched_at", 0) > cacheTtlSeconds:
+        return None
+    return cache.get("workgroups")
         
 
 # POST example for genotypes
@@ -160,9 +266,9 @@ def postGenotype(endpointUrl, myToken, animalId,genotypeAssayKey, genotypeSymbol
 
         api_call_headers = {"Content-type" : "application/json;", "Authorization": "Bearer " + myToken}
 
-        print(json.dumps(genotypeRequestDtos_dict))
-        r = requests.post(endpointUrl + 'genotypes', data=json.dumps(genotypeRequestDtos_dict), verify=True, allow_redirects=False, headers=api_call_headers)
-        print("RESULT:" + r.text)
+        logging.debug(json.dumps(genotypeRequestDtos_dict))
+        r = HttpClient.get_session().post(endpointUrl + 'genotypes', data=json.dumps(genotypeRequestDtos_dict), verify=True, allow_redirects=False, headers=api_call_headers)
+        logging.debug("RESULT:" + r.text)
         return r.status_code
     except requests.exceptions.Timeout as e: 
         print(e)
@@ -180,7 +286,7 @@ def postGenotype(endpointUrl, myToken, animalId,genotypeAssayKey, genotypeSymbol
 # PUT example for genotypes
 def putGenotype(endpointUrl, myToken, animalId, genotypekey, genotypeAssayKey, genotypeSymbolKey):
     try:
-        print(f'PUTTING genotypeAssayKey {genotypeAssayKey} and symbol key {genotypeSymbolKey} genotype for { animalId } and genotypeKey {genotypekey}.')
+        logging.debug(f'PUTTING genotypeAssayKey {genotypeAssayKey} and symbol key {genotypeSymbolKey} genotype for { animalId } and genotypeKey {genotypekey}.')
         # Construct the data payload inside out
         complete_date = datetime.datetime.now()
         date_str = '{:%Y%m%d}'.format(complete_date)
@@ -189,10 +295,11 @@ def putGenotype(endpointUrl, myToken, animalId, genotypekey, genotypeAssayKey, g
         
         api_call_headers = {"Content-type" : "application/json;", "Authorization": "Bearer " + myToken}
 
-        print(json.dumps(genotype_dict))
+        logging.debug(json.dumps(genotype_dict))
         
-        r = requests.put(endpointUrl + 'genotypes/'+ str(genotypekey), data=json.dumps(genotype_dict), headers=api_call_headers)
-        print("RESULT:" + r.text)
+        r = HttpClient.get_session().put(endpointUrl + 'genotypes/'+ str(genotypekey), data=json.dumps(genotype_dict), headers=api_call_headers)
+        logging.debug("RESULT:" + r.text)
+        return r.status_code
         
     except requests.exceptions.Timeout as e: 
         print(e)
@@ -207,3 +314,94 @@ def putGenotype(endpointUrl, myToken, animalId, genotypekey, genotypeAssayKey, g
         print(e)
         raise SystemExit(e)
 
+
+# Batch POST for genotypes. Each record is a dict with animalID, genotypeAssayKey and genotypeSymbolKey.
+def postGenotypes(endpointUrl, myToken, records, chunkSize=100):
+
+    """
+
+    Post many genotypes to Climb, several animals per request.
+
+    Parameters:
+
+        endpointUrl (str): Climb's endpoint URL.
+
+        myToken (str): The token returned by a call to getToken
+
+        records (list): A list of dicts, each with the keys animalID, genotypeAssayKey and genotypeSymbolKey.
+
+        chunkSize (int): The maximum number of records posted in one request.
+
+    Returns:
+
+        statuses (list): The HTTP status code for each record, in the same order as records, or None if
+            the request carrying it failed outright. A chunk that Climb rejects is split in half and each
+            half posted again, down to single records, so a rejected record gets its own status and
+            doesn't fail the records posted with it.
+
+    """
+
+    date_str = '{:%Y%m%d}'.format(datetime.datetime.now())
+    api_call_headers = {"Content-type" : "application/json;", "Authorization": "Bearer " + myToken}
+
+    def post_chunk(chunk, start):
+        genotypeRequestDtos_ls = [{ "animalID" : record["animalID"], "plateKey" : None,
+            "genotypes" : [{ "date" : date_str, "genotypeAssayKey" : record["genotypeAssayKey"],
+                "genotypeSymbolKey" : record["genotypeSymbolKey"] }]} for record in chunk]
+        try:
+            r = HttpClient.get_session().post(endpointUrl + 'genotypes', data=json.dumps({ "genotypeRequestDtos" : genotypeRequestDtos_ls }),
+                verify=True, allow_redirects=False, headers=api_call_headers)
+            logging.debug(f"Posted {len(chunk)} genotypes, status {r.status_code}. RESULT:" + r.text)
+        except requests.exceptions.RequestException as e:
+            # Keep going, so one bad chunk doesn't stop the rest of the load.
+            logging.error(f"Could not post {len(chunk)} genotypes starting at record {start}: {str(e)}")
+            return [None] * len(chunk)
+
+        if 200 <= r.status_code < 300 or len(chunk) == 1:
+            return [r.status_code] * len(chunk)
+        # Climb rejected the chunk. Find which records it rejected by posting each half on its own.
+        logging.debug(f"Splitting {len(chunk)} rejected genotypes starting at record {start}.")
+        half = len(chunk) // 2
+        return post_chunk(chunk[:half], start) + post_chunk(chunk[half:], start + half)
+
+    statuses = []
+    for start in range(0, len(records), chunkSize):
+        statuses += post_chunk(records[start:start + chunkSize], start)
+    return statuses
+
+
+# Batch PUT for genotypes. Each record is a dict with animalID, genotypeKey, genotypeAssayKey and genotypeSymbolKey.
+def putGenotypes(endpointUrl, myToken, records, maxWorkers=8):
+
+    """
+
+    Update many genotypes in Climb, with several requests in flight at once.
+
+    Parameters:
+
+        endpointUrl (str): Climb's endpoint URL.
+
+        myToken (str): The token returned by a call to getToken
+
+        records (list): A list of dicts, each with the keys animalID, genotypeKey, genotypeAssayKey
+            and genotypeSymbolKey.
+
+        maxWorkers (int): The maximum number of concurrent requests.
+
+    Returns:
+
+        statuses (list): The HTTP status code for each record, in the same order as records, or None
+            if the request for that record failed outright.
+
+    """
+
+    def put_one(record):
+        try:
+            return putGenotype(endpointUrl, myToken, record["animalID"], record["genotypeKey"],
+                record["genotypeAssayKey"], record["genotypeSymbolKey"])
+        except (Exception, SystemExit) as e:
+            logging.error(f"Could not put genotype {record['genotypeKey']} for animal {record['animalID']}: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        return list(executor.map(put_one, records))